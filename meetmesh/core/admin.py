@@ -1,6 +1,6 @@
 from django.contrib import admin
 
-from .models import Conversation, Message
+from .models import Conversation, ConversationSummary, Message
 
 
-admin.site.register([Conversation, Message])
\ No newline at end of file
+admin.site.register([Conversation, ConversationSummary, Message])
\ No newline at end of file
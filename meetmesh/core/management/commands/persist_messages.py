@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.message_queue import run_persister
+
+
+class Command(BaseCommand):
+    help = "Persist queued chat messages to the database in batches, see core/message_queue.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of messages inserted per transaction (default: 500)'
+        )
+        parser.add_argument(
+            '--consumer', default=None,
+            help='Name of this persister in the stream consumer group (default: hostname)'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once the queue is drained instead of waiting for new messages'
+        )
+
+    def handle(self, *args, **options):
+        run_persister(batch_size=options['batch_size'], consumer=options['consumer'], once=options['once'])
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.models import ConversationSummary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the inbox summaries of every conversation from its messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of summaries inserted per query (default: 1000)'
+        )
+
+    def handle(self, *args, **options):
+        ConversationSummary.rebuild(batch_size=options['batch_size'])
+        total = ConversationSummary.objects.count()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} conversation summaries"))
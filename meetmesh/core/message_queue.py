@@ -0,0 +1,260 @@
+"""
+Write-behind persistence of chat messages.
+
+Sending a message appends it to a Redis stream (CHAT_STREAM) and returns once
+Redis has it, the database write happens later in `manage.py persist_messages`,
+which reads the stream in batches, bulk inserts them and updates the inbox
+summaries with one UPDATE per conversation. A message is acknowledged on the
+stream only after its batch committed, so a crashed persister's batch is
+claimed by another persister. A batch some row of which is rejected is
+retried entry by entry, and an entry still rejected after CHAT_MAX_DELIVERIES
+reads (a deleted sender or conversation, say) is moved to
+CHAT_DEAD_LETTER_STREAM so it cannot hold up the messages behind it. While
+the database is unreachable the batch in hand is retried with backoff and
+nothing is dead-lettered.
+
+Every message carries the sender's client id. Enqueueing the same
+(sender, client_id) twice returns the first message instead of a new one, and
+the unique constraint on Message keeps a redelivered batch from being stored
+twice. A message's created_at is the time Redis appended it to the stream,
+taken from its entry id, so retries and persister lag never reorder a
+conversation or make a message look newer than a read watermark.
+"""
+import logging
+import socket
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import (
+    DatabaseError, DataError, IntegrityError, InterfaceError, OperationalError, close_old_connections, connection,
+    transaction,
+)
+from redis.exceptions import ResponseError
+
+from utilities.utils import generate_uuid
+from .models import ConversationSummary, Message
+
+logger = logging.getLogger(__file__)
+
+GROUP = "persisters"
+
+# claim the client id and append the message atomically, or return the message that claimed it first
+ENQUEUE_SCRIPT = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+    redis.call('XADD', KEYS[2], '*', unpack(ARGV, 3))
+    return {1, ARGV[1]}
+end
+return {0, redis.call('GET', KEYS[1])}
+"""
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    import redis
+    return redis.Redis.from_url(settings.CHAT_QUEUE_REDIS_URL, decode_responses=True)
+
+
+@lru_cache(maxsize=None)
+def get_enqueue_script():
+    return get_redis().register_script(ENQUEUE_SCRIPT)
+
+
+@lru_cache(maxsize=None)
+def get_async_enqueue_script():
+    import redis.asyncio
+    return redis.asyncio.Redis.from_url(settings.CHAT_QUEUE_REDIS_URL, decode_responses=True).register_script(ENQUEUE_SCRIPT)
+
+
+def enqueue(conversation_id, sender_id, content, client_id=None):
+    """ (message_id, created), created is False when client_id was already sent by sender_id """
+    created, message_id = get_enqueue_script()(**_enqueue_arguments(conversation_id, sender_id, content, client_id))
+    return message_id, bool(created)
+
+
+async def aenqueue(conversation_id, sender_id, content, client_id=None):
+    """ enqueue for the websocket consumers """
+    created, message_id = await get_async_enqueue_script()(**_enqueue_arguments(conversation_id, sender_id, content, client_id))
+    return message_id, bool(created)
+
+
+def _enqueue_arguments(conversation_id, sender_id, content, client_id):
+    client_id = client_id or generate_uuid()
+    message_id = generate_uuid()
+    fields = {
+        "id": message_id,
+        "client_id": client_id,
+        "conversation": conversation_id,
+        "sender": sender_id,
+        "content": content,
+    }
+    return dict(
+        keys=[f"{settings.CHAT_STREAM}:client:{sender_id}:{client_id}", settings.CHAT_STREAM],
+        args=[message_id, settings.CHAT_CLIENT_ID_TTL, *(value for field in fields.items() for value in field)],
+    )
+
+
+def persist(entries):
+    """ store stream entries [(entry_id, fields)] that are not stored yet, returns the new messages """
+    messages = [
+        Message(
+            id=fields["id"],
+            client_id=fields["client_id"],
+            conversation_id=fields["conversation"],
+            sender_id=fields["sender"],
+            content=fields["content"],
+            created_at=sent_at(entry_id),
+        )
+        for entry_id, fields in entries
+    ]
+
+    with transaction.atomic():
+        # a redelivered batch, or a send retried after its client id expired in Redis
+        stored = set(Message.objects.filter(
+            sender_id__in={message.sender_id for message in messages},
+            client_id__in={message.client_id for message in messages},
+        ).values_list("sender_id", "client_id"))
+        unique = {}
+        for message in messages:
+            if (message.sender_id, message.client_id) not in stored:
+                unique.setdefault((message.sender_id, message.client_id), message)
+        messages = list(unique.values())
+
+        sent = [message.created_at for message in messages]
+        Message.objects.bulk_create(messages)
+        _restore_created_at(messages, sent)
+        ConversationSummary.record_messages(messages)
+    return messages
+
+
+def sent_at(entry_id):
+    """
+    when entry_id was appended, "<milliseconds>-<sequence>". The sequence of
+    entries sharing a millisecond becomes microseconds to keep them in order
+    """
+    milliseconds, sequence = entry_id.split("-")
+    return datetime.fromtimestamp(int(milliseconds) / 1000, tz=dt_timezone.utc) + timedelta(microseconds=min(int(sequence), 999))
+
+
+def _restore_created_at(messages, sent):
+    """ bulk_create stamps auto_now_add fields with the current time, put the send times back in one UPDATE """
+    if not messages:
+        return
+    for message, created_at in zip(messages, sent):
+        message.created_at = created_at
+
+    table = connection.ops.quote_name(Message._meta.db_table)
+    column = connection.ops.quote_name(Message._meta.get_field("created_at").column)
+    values = ", ".join(["(%s, %s::timestamp with time zone)"] * len(messages))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} AS m SET {column} = v.created_at "
+            f"FROM (VALUES {values}) AS v (id, created_at) WHERE m.id = v.id",
+            [value for message in messages for value in (message.id, message.created_at)]
+        )
+
+
+def run_persister(batch_size=500, block_ms=1000, consumer=None, once=False):
+    """ persist the stream forever, or until it is drained with once=True """
+    redis = get_redis()
+    consumer = consumer or socket.gethostname()
+    try:
+        redis.xgroup_create(settings.CHAT_STREAM, GROUP, id="0", mkstream=True)
+    except ResponseError as error:
+        if "BUSYGROUP" not in str(error):
+            raise
+
+    # "0" re-reads this consumer's unacknowledged entries, ">" reads new ones
+    start = "0"
+    claimed_at = None
+    while True:
+        if claimed_at is None or time.monotonic() - claimed_at >= settings.CHAT_CLAIM_INTERVAL:
+            claim_abandoned(redis, consumer, batch_size)
+            claimed_at = time.monotonic()
+            start = "0"
+
+        response = redis.xreadgroup(
+            GROUP, consumer, {settings.CHAT_STREAM: start}, count=batch_size, block=None if start == "0" else block_ms
+        )
+        entries = response[0][1] if response else []
+        if not entries:
+            if start == ">" and once:
+                return
+            start = ">"
+            continue
+
+        close_old_connections()
+        try:
+            entry_ids = persist_batch(redis, entries)
+        except DatabaseError:
+            logger.exception(f"Could not persist {len(entries)} messages, retrying")
+            entry_ids = []
+
+        if entry_ids:
+            with redis.pipeline() as pipeline:
+                pipeline.xack(settings.CHAT_STREAM, GROUP, *entry_ids)
+                pipeline.xdel(settings.CHAT_STREAM, *entry_ids)
+                pipeline.execute()
+
+        if len(entry_ids) < len(entries):
+            # the rest stays pending and is read again
+            time.sleep(1)
+            start = "0"
+
+
+def persist_batch(redis, entries):
+    """
+    persist entries, returns the ids of those that are done. Waits out lost
+    database connections, re-raises other database errors
+    """
+    delay = 1
+    while True:
+        try:
+            try:
+                persist(entries)
+                return [entry_id for entry_id, _ in entries]
+            except (IntegrityError, DataError):
+                logger.exception(f"Could not persist {len(entries)} messages, retrying one by one")
+                return persist_each(redis, entries)
+        except (OperationalError, InterfaceError):
+            # retried from memory, a re-read would count as a delivery
+            logger.exception(f"Database unavailable, retrying {len(entries)} messages in {delay}s")
+            connection.close()
+            time.sleep(delay)
+            delay = min(delay * 2, settings.CHAT_RETRY_MAX_DELAY)
+
+
+def persist_each(redis, entries):
+    """
+    persist entries one at a time, returns the ids of those that are done: stored,
+    or dead-lettered after being rejected CHAT_MAX_DELIVERIES times
+    """
+    deliveries = {
+        pending["message_id"]: pending["times_delivered"]
+        for pending in redis.xpending_range(settings.CHAT_STREAM, GROUP, entries[0][0], entries[-1][0], len(entries))
+    }
+
+    done = []
+    for entry_id, fields in entries:
+        try:
+            persist([(entry_id, fields)])
+        except (IntegrityError, DataError):
+            if deliveries.get(entry_id, 1) < settings.CHAT_MAX_DELIVERIES:
+                logger.exception(f"Could not persist message {fields.get('id')}, retrying")
+                continue
+            logger.exception(f"Could not persist message {fields.get('id')}, moving it to {settings.CHAT_DEAD_LETTER_STREAM}")
+            redis.xadd(settings.CHAT_DEAD_LETTER_STREAM, {**fields, "entry_id": entry_id})
+        done.append(entry_id)
+    return done
+
+
+def claim_abandoned(redis, consumer, batch_size):
+    """ take over entries that persisters that are gone read but never acknowledged """
+    cursor = "0-0"
+    while True:
+        cursor = redis.xautoclaim(
+            settings.CHAT_STREAM, GROUP, consumer, settings.CHAT_CLAIM_IDLE_MS, start_id=cursor, count=batch_size
+        )[0]
+        if cursor == "0-0":
+            break
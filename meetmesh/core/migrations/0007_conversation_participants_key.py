@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+def set_participants_keys(apps, schema_editor):
+    """ key the oldest conversation of every pair, rooms created twice by a race keep no key """
+    Conversation = apps.get_model('core', 'Conversation')
+    Membership = Conversation.participants.through
+
+    participants = {}
+    for conversation_id, user_id in Membership.objects.values_list('conversation_id', 'user_id').iterator():
+        participants.setdefault(conversation_id, []).append(user_id)
+
+    keyed, batch = set(), []
+    for conversation in Conversation.objects.order_by('created_at', 'id').only('id').iterator():
+        user_ids = participants.get(conversation.id, [])
+        if len(user_ids) not in (1, 2):
+            continue
+        if len(user_ids) == 1:
+            # a conversation with yourself
+            user_ids = user_ids * 2
+        key = ":".join(sorted(str(user_id) for user_id in user_ids))
+        if key in keyed:
+            continue
+        keyed.add(key)
+        conversation.participants_key = key
+        batch.append(conversation)
+
+    Conversation.objects.bulk_update(batch, ['participants_key'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_message_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='participants_key',
+            field=models.CharField(blank=True, max_length=601, null=True, unique=True),
+        ),
+        migrations.RunPython(set_participants_keys, migrations.RunPython.noop),
+    ]
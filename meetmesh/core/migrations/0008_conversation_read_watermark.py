@@ -0,0 +1,39 @@
+# Generated by Django 5.2 on 2026-10-18 08:06
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def set_read_watermarks(apps, schema_editor):
+    """ the newest message each participant received and had marked read """
+    ConversationSummary = apps.get_model('core', 'ConversationSummary')
+    Message = apps.get_model('core', 'Message')
+
+    read_messages = Message.objects.filter(
+        conversation=OuterRef('conversation_id'), is_read=True
+    ).exclude(sender=OuterRef('user_id')).order_by('-created_at')
+    ConversationSummary.objects.update(last_read_at=Subquery(read_messages.values('created_at')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_conversation_participants_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationsummary',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(set_read_watermarks, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_unread_idx',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -1,4 +1,10 @@
-from django.db import models
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, Exists, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest, Substr
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from utilities.utils import BaseModelMixin
 from utilities import choices
@@ -6,33 +12,203 @@ from utilities import choices
 
 User = get_user_model()
 
+# last_read_at of someone who never read a conversation
+NEVER = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
 class Conversation(BaseModelMixin):
     participants = models.ManyToManyField("user.User", related_name='conversations')
+    # "<smaller user id>:<larger user id>" of a direct conversation, see get_room
+    participants_key = models.CharField(max_length=601, unique=True, null=True, blank=True)
 
     def get_receiver(self, current_user):
-        return self.participants.exclude(id=current_user.id).first()
-    
+        # current_user themselves in a conversation with yourself
+        return self.participants.exclude(id=current_user.id).first() or current_user
+
+    @staticmethod
+    def make_participants_key(*user_ids):
+        return ":".join(sorted(str(user_id) for user_id in user_ids))
+
     @classmethod
     def get_room(cls, receiver, sender):
+        """ the direct conversation of receiver and sender, created on first use """
         if not receiver or not sender:
             raise ValueError("Receiver and sender must be provided")
 
-        conversation = cls.objects.filter(participants=receiver).filter(participants=sender).first()
+        key = cls.make_participants_key(receiver.id, sender.id)
+        conversation = cls.objects.filter(participants_key=key).first()
+        if conversation:
+            return conversation
 
-        if not conversation:
-            conversation = cls.objects.create()
-            conversation.participants.add(receiver, sender)
+        try:
+            with transaction.atomic():
+                conversation = cls.objects.create(participants_key=key)
+                conversation.participants.add(receiver, sender)
+                # one summary when sender and receiver are the same user
+                ConversationSummary.objects.bulk_create([
+                    ConversationSummary(conversation=conversation, user=user, partner=partner)
+                    for user, partner in {(receiver, sender), (sender, receiver)}
+                ])
+        except IntegrityError:
+            # a concurrent first message created it, anything else is not ours to hide
+            conversation = cls.objects.filter(participants_key=key).first()
+            if conversation is None:
+                raise
 
         return conversation
 
 class Message(BaseModelMixin):
     content = models.TextField()
     sender = models.ForeignKey(User, on_delete=models.SET_DEFAULT, default='deleted_account_user', related_name='message_sender')
-    is_read = models.BooleanField(default=False)
     conversation = models.ForeignKey(Conversation, related_name='messages', on_delete=models.CASCADE)
+    # the sender's id for the message, a retried send with the same id is stored once
+    client_id = models.CharField(max_length=64, null=True, blank=True)
 
     class Meta:
         ordering = ['created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['sender', 'client_id'], condition=models.Q(client_id__isnull=False), name='message_client_id_unique'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_history_idx'),
+        ]
+
+
+class ConversationSummary(BaseModelMixin):
+    """
+    One inbox row per participant of a conversation, kept up to date as messages
+    are written so listing the inbox is a single indexed range read.
+
+    Read state is the participant's last_read_at watermark: a message is read by
+    them once it is not newer than it, see mark_read and read_watermarks.
+    """
+    PREVIEW_LENGTH = 200
+
+    conversation = models.ForeignKey(Conversation, related_name='summaries', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='conversation_summaries', on_delete=models.CASCADE)
+    partner = models.ForeignKey(User, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_message = models.ForeignKey(Message, related_name='+', on_delete=models.SET_NULL, null=True, blank=True)
+    last_message_content = models.TextField(blank=True, default="")
+    last_message_time = models.DateTimeField(null=True, blank=True)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('conversation', 'user')
+        indexes = [
+            models.Index(fields=['user', '-last_message_time', '-id'], name='conversation_inbox_idx'),
+        ]
+
+    @classmethod
+    def record_message(cls, message):
+        """
+        Move the summaries of the message's conversation to this message and count
+        it as unread for everyone but the sender. Call inside the transaction that
+        saves the message.
+        """
+        cls.record_messages([message])
+
+    @classmethod
+    def record_messages(cls, messages):
+        """ record_message for a batch, one UPDATE per conversation """
+        by_conversation = {}
+        for message in messages:
+            by_conversation.setdefault(message.conversation_id, []).append(message)
+
+        for conversation_id, batch in by_conversation.items():
+            latest = max(batch, key=lambda message: (message.created_at, message.id))
+            sent = Counter(message.sender_id for message in batch)
+
+            is_newer = Q(last_message_time__isnull=True) | Q(last_message_time__lte=latest.created_at)
+            updated = cls.objects.filter(conversation_id=conversation_id).update(
+                last_message=Case(When(is_newer, then=Value(latest.id)), default=F('last_message')),
+                last_message_content=Case(
+                    When(is_newer, then=Value(latest.content[:cls.PREVIEW_LENGTH], output_field=models.TextField())),
+                    default=F('last_message_content')
+                ),
+                last_message_time=Case(When(is_newer, then=Value(latest.created_at)), default=F('last_message_time')),
+                # everyone gets the batch as unread except their own messages
+                unread_count=Case(
+                    *(When(user_id=sender_id, then=F('unread_count') + len(batch) - count) for sender_id, count in sent.items()),
+                    default=F('unread_count') + len(batch)
+                ),
+            )
+
+            if not updated:
+                # conversation created before summaries existed
+                cls.rebuild(Conversation.objects.filter(id=conversation_id))
+
+    @classmethod
+    def mark_read(cls, conversation, user, read_at=None):
+        """ move user's watermark in conversation to read_at (now), one row whatever the message count """
+        read_at = read_at or timezone.now()
+        cls.objects.filter(conversation=conversation, user=user).update(
+            # never backwards, e.g. when two devices report out of order
+            last_read_at=Greatest(Coalesce(F('last_read_at'), Value(read_at)), Value(read_at)),
+            unread_count=0,
+        )
+        return read_at
+
+    @classmethod
+    def read_watermarks(cls, conversation):
+        """ {user_id: last_read_at} of the participants of conversation """
+        return dict(cls.objects.filter(conversation=conversation).values_list('user_id', 'last_read_at'))
+
+    @classmethod
+    def rebuild(cls, conversations=None, batch_size=1000):
+        """ recompute the summaries of the given conversations (all by default) from their messages """
+        Membership = Conversation.participants.through
+        memberships = Membership.objects.all()
+        if conversations is not None:
+            memberships = memberships.filter(conversation__in=conversations)
+
+        latest_messages = Message.objects.filter(conversation=OuterRef('conversation_id')).order_by('-created_at', '-id')
+        watermarks = cls.objects.filter(conversation_id=OuterRef('conversation_id'), user_id=OuterRef('user_id'))
+        memberships = memberships.annotate(last_read_at=Subquery(watermarks.values('last_read_at')[:1]))
+        unread_messages = Message.objects.filter(
+            conversation=OuterRef('conversation_id'),
+            created_at__gt=Coalesce(OuterRef('last_read_at'), Value(NEVER)),
+        ).exclude(sender=OuterRef('user_id')).order_by().values('conversation').annotate(count=Count('id')).values('count')
+        partners = Membership.objects.filter(
+            conversation_id=OuterRef('conversation_id')
+        ).exclude(user_id=OuterRef('user_id')).values('user_id')
+
+        rows = memberships.annotate(
+            # yourself in a conversation with yourself
+            partner_id=Coalesce(Subquery(partners[:1]), F('user_id')),
+            last_message_id=Subquery(latest_messages.values('id')[:1]),
+            last_message_content=Substr(Subquery(latest_messages.values('content')[:1]), 1, cls.PREVIEW_LENGTH),
+            last_message_time=Subquery(latest_messages.values('created_at')[:1]),
+            unread_count=Coalesce(Subquery(unread_messages), 0),
+        ).values(
+            'conversation_id', 'user_id', 'partner_id', 'last_message_id',
+            'last_message_content', 'last_message_time', 'unread_count'
+        )
+
+        # upserted in place so the read watermarks survive
+        upsert = dict(
+            update_conflicts=True,
+            unique_fields=['conversation', 'user'],
+            update_fields=['partner', 'last_message', 'last_message_content', 'last_message_time', 'unread_count'],
+        )
+        with transaction.atomic():
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                row['last_message_content'] = row['last_message_content'] or ""
+                batch.append(cls(**row))
+                if len(batch) >= batch_size:
+                    cls.objects.bulk_create(batch, **upsert)
+                    batch = []
+            cls.objects.bulk_create(batch, **upsert)
+
+            # summaries of people no longer in the conversation
+            summaries = cls.objects.all()
+            if conversations is not None:
+                summaries = summaries.filter(conversation__in=conversations)
+            summaries.exclude(
+                Exists(Membership.objects.filter(conversation_id=OuterRef('conversation_id'), user_id=OuterRef('user_id')))
+            ).delete()
 
 
 class Meetup(models.Model):
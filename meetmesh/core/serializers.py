@@ -1,7 +1,6 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from django.db.models import Q
-from .models import Message, Conversation, Meetup
+from .models import Message, Conversation, ConversationSummary, Meetup
 
 User = get_user_model()
 
@@ -9,17 +8,14 @@ User = get_user_model()
 
 class MessageSerializer:
 
-    class MessageCreateSerializer(serializers.ModelSerializer):
-        class Meta:
-            model = Message
-            fields = (
-                "content",
-                "sender",
-                "conversation"
-            )
+    class MessageSendSerializer(serializers.Serializer):
+        """ a message to queue, see core/message_queue.py """
+        content = serializers.CharField()
+        client_id = serializers.CharField(max_length=64, required=False)
 
     class MessageRetrieveSerializer(serializers.ModelSerializer):
         is_sender = serializers.SerializerMethodField()
+        is_read = serializers.SerializerMethodField()
 
         class Meta:
             model = Message
@@ -27,10 +23,18 @@ class MessageSerializer:
 
         def get_is_sender(self, obj):
             request = self.context.get('request')
-            if request and obj.sender == request.user:
+            if request and obj.sender_id == request.user.id:
                 return True
             return False
 
+        def get_is_read(self, obj):
+            """ read by another participant, from the `read_watermarks` passed in by the view """
+            return any(
+                read_at is not None and read_at >= obj.created_at
+                for user_id, read_at in self.context.get('read_watermarks', {}).items()
+                if user_id != obj.sender_id
+            )
+
 
 class ConversationSerializer:
 
@@ -55,15 +59,16 @@ class ConversationSerializer:
             }
         
     class ConversationListSerializer(serializers.ModelSerializer):
+        """ one inbox row, read from the current user's ConversationSummary """
+        id = serializers.CharField(source="conversation_id", read_only=True)
         conversation_partner = serializers.SerializerMethodField()
-        content = serializers.SerializerMethodField()
-        last_message_time = serializers.SerializerMethodField()
-        number_of_unread_messages = serializers.SerializerMethodField()
+        content = serializers.CharField(source="last_message_content", read_only=True)
+        last_message_time = serializers.DateTimeField(read_only=True)
+        number_of_unread_messages = serializers.IntegerField(source="unread_count", read_only=True)
 
         class Meta:
-            model = Conversation
+            model = ConversationSummary
             fields = (
-                "id",
                 "id",
                 "conversation_partner",
                 "content",
@@ -72,30 +77,20 @@ class ConversationSerializer:
             )
 
         def get_conversation_partner(self, obj):
-            current_user = self.context.get('request').user
-            partner = obj.get_receiver(current_user)
+            partner = obj.partner
+            if partner is None:
+                # deleted account
+                return None
             return {
                 "avatar": getattr(partner.profile.profile_image, 'url', None) if partner and partner.profile.profile_image else None,
-                "fullname": partner.fullname.strip() or partner.username.strip() or partner.email
+                "fullname": partner.fullname.strip() or partner.username.strip() or partner.email,
+                # presence of the whole page, looked up once by the view
+                "is_online": self.context.get("online", {}).get(obj.partner_id, False),
             }
-        
-        def get_content(self, obj):
-            last_msg = obj.messages.order_by("-created_at").first()
-            return last_msg.content if last_msg else None
-
-        def get_last_message_time(self, obj):
-            last_msg = obj.messages.order_by("-created_at").first()
-            return last_msg.created_at if last_msg else None
-
-        def get_number_of_unread_messages(self, obj):
-            request = self.context.get("request")
-            if request:
-                return obj.messages.filter(Q(is_read=False) & ~Q(sender=request.user)).count()
-            return 0
     
     class ConversationDetailSerializer(serializers.ModelSerializer):
 
-        messages = MessageSerializer.MessageRetrieveSerializer(many=True)
+        messages = serializers.SerializerMethodField()
         conversation_partner = serializers.SerializerMethodField()
         class Meta:
             model = Conversation
@@ -104,6 +99,11 @@ class ConversationSerializer:
                 "messages",
                 "conversation_partner"
             )
+
+        def get_messages(self, obj):
+            """ only the latest window of messages, passed in by the view in chronological order """
+            messages = self.context.get("messages", [])
+            return MessageSerializer.MessageRetrieveSerializer(messages, many=True, context=self.context).data
         
         def get_conversation_partner(self, obj):
             current_user = self.context.get("request").user
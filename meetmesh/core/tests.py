@@ -1,3 +1,314 @@
-from django.test import TestCase
+import asyncio
+import multiprocessing
+import threading
+from importlib.util import find_spec
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.db import IntegrityError, OperationalError
+from datetime import datetime, timezone
+
+from django.test import SimpleTestCase, TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from user.models import User
+from utilities.pagination import MessagePagination
+from . import message_queue
+from .models import Conversation, ConversationSummary, Message
+
+
+class ConversationListTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="owner@meetmesh.test", username="owner", password="password")
+
+        for index in range(12):
+            partner = User.objects.create_user(
+                email=f"partner{index}@meetmesh.test", username=f"partner{index}", password="password"
+            )
+            conversation = Conversation.get_room(partner, self.user)
+            Message.objects.create(conversation=conversation, sender=partner, content=f"hello {index}")
+            Message.objects.create(conversation=conversation, sender=self.user, content=f"hi {index}")
+
+        ConversationSummary.rebuild()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        for limit in (2, 12):
+            # summaries joined with the partner and their profile
+            with self.assertNumQueries(1):
+                response = self.client.get("/conversations/", {"limit": limit})
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data["results"]), limit)
+
+    def test_unread_count_excludes_own_messages(self):
+        response = self.client.get("/conversations/")
+
+        for conversation in response.data["results"]:
+            self.assertEqual(conversation["number_of_unread_messages"], 1)
+            self.assertTrue(conversation["content"].startswith("hi"))
+
+    def test_new_message_updates_summaries(self):
+        partner = User.objects.get(username="partner0")
+        conversation = Conversation.get_room(partner, self.user)
+        message = Message.objects.create(conversation=conversation, sender=partner, content="are you around?")
+        ConversationSummary.record_message(message)
+
+        own = ConversationSummary.objects.get(conversation=conversation, user=self.user)
+        theirs = ConversationSummary.objects.get(conversation=conversation, user=partner)
+        self.assertEqual(own.last_message_id, message.id)
+        self.assertEqual(own.unread_count, 2)
+        self.assertEqual(theirs.last_message_content, "are you around?")
+
+        read_at = ConversationSummary.mark_read(conversation, self.user)
+        own.refresh_from_db()
+        self.assertEqual(own.unread_count, 0)
+        self.assertEqual(own.last_read_at, read_at)
+
+        # the watermark survives a rebuild, so nothing already read comes back as unread
+        ConversationSummary.rebuild([conversation])
+        own.refresh_from_db()
+        self.assertEqual((own.unread_count, own.last_read_at), (0, read_at))
+
+
+class ConversationAccessTest(TestCase):
+    def setUp(self):
+        self.sender = User.objects.create_user(email="sender@meetmesh.test", username="sender", password="password")
+        self.receiver = User.objects.create_user(email="receiver@meetmesh.test", username="receiver", password="password")
+        self.outsider = User.objects.create_user(email="outsider@meetmesh.test", username="outsider", password="password")
+        self.conversation = Conversation.get_room(self.receiver, self.sender)
+        Message.objects.create(conversation=self.conversation, sender=self.sender, content="hello")
+        self.client = APIClient()
+
+    def test_participant_reads_history(self):
+        self.client.force_authenticate(self.receiver)
+        response = self.client.get(f"/conversations/{self.conversation.id}/messages/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([message["content"] for message in response.data["results"]], ["hello"])
+
+    def test_non_participant_gets_404(self):
+        self.client.force_authenticate(self.outsider)
+
+        for url in (f"/conversations/{self.conversation.id}/", f"/conversations/{self.conversation.id}/messages/"):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_conversations_cannot_be_updated_or_deleted(self):
+        self.client.force_authenticate(self.sender)
+        url = f"/conversations/{self.conversation.id}/"
+
+        for method in (self.client.put, self.client.patch, self.client.delete):
+            self.assertEqual(method(url, {}).status_code, 405)
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        sender = User.objects.create_user(email="sender@meetmesh.test", username="sender", password="password")
+        receiver = User.objects.create_user(email="receiver@meetmesh.test", username="receiver", password="password")
+        self.conversation = Conversation.get_room(receiver, sender)
+        for index in range(10):
+            Message.objects.create(conversation=self.conversation, sender=sender, content=f"message {index}")
+
+        # most messages share a timestamp, so only the id tells them apart
+        messages = list(self.conversation.messages.order_by("id"))
+        Message.objects.filter(id__in=[message.id for message in messages[:7]]).update(
+            created_at=datetime(2026, 1, 1, tzinfo=timezone.utc)
+        )
+        Message.objects.filter(id__in=[message.id for message in messages[7:]]).update(
+            created_at=datetime(2026, 1, 2, tzinfo=timezone.utc)
+        )
+        self.expected = list(self.conversation.messages.order_by("-created_at", "-id").values_list("id", flat=True))
+
+    def get_page(self, url):
+        paginator = MessagePagination()
+        page = paginator.paginate_queryset(self.conversation.messages.all(), Request(APIRequestFactory().get(url)))
+        return [message.id for message in page], paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_next_links_walk_every_message_once(self):
+        pages, url = [], "/messages/?limit=3"
+        while url:
+            page, url, _ = self.get_page(url)
+            pages.append(page)
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual([message for page in pages for message in page], self.expected)
+
+    def test_previous_links_walk_back_the_same_pages(self):
+        pages, url = [], "/messages/?limit=4"
+        while url:
+            page, url, previous = self.get_page(url)
+            pages.append(page)
+
+        backwards = []
+        while previous:
+            page, _, previous = self.get_page(previous)
+            backwards.append(page)
+
+        self.assertEqual(backwards, pages[-2::-1])
+        self.assertIsNone(self.get_page("/messages/?limit=4")[2])
+
+
+class GetRoomTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="me@meetmesh.test", username="me", password="password")
+        self.partner = User.objects.create_user(email="you@meetmesh.test", username="you", password="password")
+
+    def test_one_room_per_pair_in_either_order(self):
+        room = Conversation.get_room(self.partner, self.user)
+
+        self.assertEqual(Conversation.get_room(self.user, self.partner), room)
+        self.assertEqual(room.summaries.count(), 2)
+
+    def test_conversation_with_yourself(self):
+        room = Conversation.get_room(self.user, self.user)
+
+        self.assertEqual(Conversation.get_room(self.user, self.user), room)
+        summary = room.summaries.get()
+        self.assertEqual((summary.user, summary.partner), (self.user, self.user))
+
+        ConversationSummary.record_message(Message.objects.create(conversation=room, sender=self.user, content="note"))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get("/conversations/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["results"][0]["conversation_partner"]["fullname"], "me")
+
+
+def receive_group_message(config, group, ready, received):
+    """ a second process holding one socket in `group`, like another Daphne worker """
+    from channels_redis.core import RedisChannelLayer
+
+    async def main():
+        layer = RedisChannelLayer(**config)
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        ready.set()
+        received.put(await asyncio.wait_for(layer.receive(channel), 10))
+        await layer.flush()
+
+    asyncio.run(main())
+
+
+@skipUnless(find_spec("channels_redis") and find_spec("fakeredis"), "needs channels_redis and fakeredis")
+class RedisChannelLayerTest(SimpleTestCase):
+    def setUp(self):
+        from fakeredis import TcpFakeServer
+
+        # two shards, so group membership and the socket's channel may live on different servers
+        hosts = []
+        for _ in range(2):
+            server = TcpFakeServer(("127.0.0.1", 0), bind_and_activate=False)
+            # the default listen backlog of 5 resets connections when every worker connects at once
+            server.request_queue_size = 1024
+            server.server_bind()
+            server.server_activate()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            hosts.append("redis://%s:%s/0" % server.server_address)
+        self.config = {"hosts": hosts, "prefix": "test"}
+
+    def test_group_send_reaches_another_process(self):
+        from channels_redis.core import RedisChannelLayer
+
+        context = multiprocessing.get_context("fork")
+        ready, received = context.Event(), context.Queue()
+        for group in ("conversation_1", "conversation_2", "conversation_3"):
+            with self.subTest(group=group):
+                worker = context.Process(target=receive_group_message, args=(self.config, group, ready, received))
+                worker.start()
+                self.addCleanup(worker.kill)
+                self.assertTrue(ready.wait(10))
+
+                message = {"type": "chat.message", "message": f"hello {group}"}
+                asyncio.run(RedisChannelLayer(**self.config).group_send(group, message))
+
+                self.assertEqual(received.get(timeout=10), message)
+                worker.join(10)
+                ready.clear()
+
+
+@skipUnless(find_spec("fakeredis") and find_spec("lupa"), "needs fakeredis[lua]")
+class MessageQueueTest(SimpleTestCase):
+    def setUp(self):
+        import fakeredis
+
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        self.stored = []
+        self.failures = {}
+        for patcher in (
+            mock.patch.object(message_queue, "get_redis", lambda: self.redis),
+            mock.patch.object(message_queue, "get_enqueue_script", lambda: self.redis.register_script(message_queue.ENQUEUE_SCRIPT)),
+            mock.patch.object(message_queue, "persist", self.persist),
+            mock.patch.object(message_queue, "close_old_connections"),
+            mock.patch.object(message_queue, "connection"),
+            mock.patch.object(message_queue.time, "sleep"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def persist(self, entries):
+        """ stands in for the database: content "bad" is always rejected, failures[content] raise once each """
+        for _, fields in entries:
+            if fields["content"] == "bad":
+                raise IntegrityError("message_conversation_id_fkey")
+            if self.failures.get(fields["content"]):
+                raise self.failures.pop(fields["content"])
+        self.stored.extend(fields["content"] for _, fields in entries)
+
+    def test_enqueue_deduplicates_client_ids(self):
+        first, created = message_queue.enqueue("c1", "u1", "hello", "k1")
+        self.assertTrue(created)
+
+        self.assertEqual(message_queue.enqueue("c1", "u1", "hello again", "k1"), (first, False))
+        self.assertTrue(message_queue.enqueue("c1", "u2", "hello", "k1")[1])
+        self.assertEqual(self.redis.xlen(settings.CHAT_STREAM), 2)
+
+    def test_created_at_is_the_stream_append_time(self):
+        entry_ids = ["1700000000000-0", "1700000000000-1", "1700000000001-0"]
+        times = [message_queue.sent_at(entry_id) for entry_id in entry_ids]
+
+        self.assertEqual(times, sorted(times))
+        self.assertEqual(len(set(times)), 3)
+        self.assertEqual(times[0].timestamp(), 1700000000)
+
+    def test_persisted_entries_are_acknowledged_and_deleted(self):
+        for content in ("one", "two"):
+            message_queue.enqueue("c1", "u1", content)
+        message_queue.run_persister(once=True)
+
+        self.assertEqual(self.stored, ["one", "two"])
+        self.assertEqual(self.redis.xlen(settings.CHAT_STREAM), 0)
+        self.assertEqual(self.redis.xpending(settings.CHAT_STREAM, message_queue.GROUP)["pending"], 0)
+
+    def test_unacknowledged_entries_are_redelivered(self):
+        message_queue.enqueue("c1", "u1", "lost")
+        # a persister that read the entry and died before acknowledging it
+        self.redis.xgroup_create(settings.CHAT_STREAM, message_queue.GROUP, id="0")
+        self.redis.xreadgroup(message_queue.GROUP, "gone", {settings.CHAT_STREAM: ">"})
+
+        with self.settings(CHAT_CLAIM_IDLE_MS=0):
+            message_queue.run_persister(consumer="replacement", once=True)
+        self.assertEqual(self.stored, ["lost"])
+
+    def test_rejected_entry_is_dead_lettered_after_max_deliveries(self):
+        for content in ("one", "bad", "two"):
+            message_queue.enqueue("c1", "u1", content)
+        message_queue.run_persister(once=True)
+
+        self.assertEqual(self.stored, ["one", "two"])
+        dead = self.redis.xrange(settings.CHAT_DEAD_LETTER_STREAM)
+        self.assertEqual([fields["content"] for _, fields in dead], ["bad"])
+        self.assertEqual(self.redis.xlen(settings.CHAT_STREAM), 0)
+
+    def test_lost_connection_is_retried_without_dead_lettering(self):
+        message_queue.enqueue("c1", "u1", "during failover")
+        self.failures["during failover"] = OperationalError("server closed the connection unexpectedly")
+
+        with self.settings(CHAT_MAX_DELIVERIES=1):
+            message_queue.run_persister(once=True)
+
+        self.assertEqual(self.stored, ["during failover"])
+        self.assertEqual(self.redis.xlen(settings.CHAT_DEAD_LETTER_STREAM), 0)
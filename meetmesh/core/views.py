@@ -1,10 +1,12 @@
 from rest_framework import viewsets, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db.models import OuterRef, Subquery, Count
+from rest_framework.reverse import reverse
 
-from .serializers import ConversationSerializer, MeetupSerializer
-from .models import Conversation, Message, Meetup
+from utilities.pagination import ConversationPagination, MessagePagination
+from user import presence
+from .serializers import ConversationSerializer, MeetupSerializer, MessageSerializer
+from .models import Conversation, ConversationSummary, Meetup
 
 
 class MeetupRequestViewset(viewsets.ModelViewSet):
@@ -54,37 +56,36 @@ class MeetupRequestViewset(viewsets.ModelViewSet):
             status=status.HTTP_200_OK
         )
 
-class ConversationViewset(viewsets.ModelViewSet):
+class ConversationViewset(viewsets.GenericViewSet):
+    """ list, create and retrieve only, a conversation is changed through its messages """
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer.ConversationListSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ConversationPagination
     lookup_field ='id'
 
-    def list(self, request, *args, **kwargs):
-        latest_message_time = Subquery(
-            Message.objects.filter(conversation=OuterRef('pk'))
-            .order_by('-created_at')
-            .values('created_at')[:1]
-        )
-
-        queryset = self.get_queryset().filter(
-            participants=request.user
-        ).annotate(
-            message_count=Count('messages'),
-            last_message_time=latest_message_time
-        ).filter(
-            message_count__gt=0
-        ).order_by('-last_message_time')
+    def get_queryset(self):
+        """ only conversations the current user takes part in """
+        return Conversation.objects.filter(participants=self.request.user)
 
-        self.queryset = queryset
+    def list(self, request, *args, **kwargs):
+        queryset = ConversationSummary.objects.filter(
+            user=request.user,
+            last_message_time__isnull=False
+        ).select_related('partner__profile').order_by('-last_message_time', '-id')
 
         page = self.paginate_queryset(queryset)
+        summaries = page if page is not None else list(queryset)
+        serializer = self.get_serializer(
+            summaries, many=True, context={
+                **self.get_serializer_context(),
+                "online": presence.are_online([summary.partner_id for summary in summaries if summary.partner_id]),
+            }
+        )
+
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
             return self.get_paginated_response(serializer.data)
-
-        serializer = self.get_serializer(queryset, many=True, context={'request': request})
-        return super().list(request, *args, **kwargs)
+        return Response(serializer.data)
 
 
     def create(self, request, *args, **kwargs):
@@ -104,6 +105,30 @@ class ConversationViewset(viewsets.ModelViewSet):
 
     def retrieve(self, request, *args, **kwargs):
         conversation = self.get_object() 
-        conversation.messages.filter(is_read=False).update(is_read=True)
-        serializer = ConversationSerializer.ConversationDetailSerializer(conversation, context={'request': request})
-        return Response(serializer.data)
+        ConversationSummary.mark_read(conversation, request.user)
+
+        # latest page only, older pages are fetched from the messages endpoint using `next`
+        paginator = MessagePagination()
+        messages = paginator.paginate_queryset(conversation.messages.all(), request, view=self)
+        paginator.base_url = reverse("conversations-messages", kwargs={"id": conversation.id}, request=request)
+
+        serializer = ConversationSerializer.ConversationDetailSerializer(
+            conversation,
+            context={
+                'request': request,
+                'messages': messages[::-1],
+                'read_watermarks': ConversationSummary.read_watermarks(conversation),
+            }
+        )
+        return Response(data={**serializer.data, "next": paginator.get_next_link()})
+
+    @action(methods=['get'], detail=True, permission_classes=[permissions.IsAuthenticated], pagination_class=MessagePagination)
+    def messages(self, request, *args, **kwargs):
+        """ message history of a conversation, newest first """
+        conversation = self.get_object()
+        page = self.paginate_queryset(conversation.messages.all())
+        serializer = MessageSerializer.MessageRetrieveSerializer(
+            page, many=True,
+            context={'request': request, 'read_watermarks': ConversationSummary.read_watermarks(conversation)}
+        )
+        return self.get_paginated_response(serializer.data)
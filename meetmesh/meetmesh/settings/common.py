@@ -2,6 +2,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 import environ
+from celery.schedules import crontab
 
 env = environ.Env()
 
@@ -99,4 +100,113 @@ LEAFLET_CONFIG = {
     "DEFAULT_PRECISION": 6,
     "SCALE": "both",
     "ATTRIBUTION_PREFIX": "powered by me",
-}
\ No newline at end of file
+}
+
+RECOMMENDATION_TOP_N = 10
+
+# number of users scored at a time when computing recommendations, memory use is
+# about RECOMMENDATION_BLOCK_SIZE x number of users x 4 bytes
+RECOMMENDATION_BLOCK_SIZE = 256
+
+# "exact" for blocked brute force or "ann" for the random projection index. More
+# ANN tables find more of the true neighbours at the cost of latency, more bits
+# make buckets smaller (see manage.py benchmark_recommendations)
+RECOMMENDATION_BACKEND = "exact"
+RECOMMENDATION_ANN_TABLES = 32
+RECOMMENDATION_ANN_BITS = 12
+# profile changes are collected in a Redis set and refreshed together every
+# RECOMMENDATION_REFRESH_INTERVAL seconds. A worker keeps the user vectors in
+# memory, reloading only changed rows, and rebuilds them after
+# RECOMMENDATION_VECTORS_TTL seconds
+RECOMMENDATION_REDIS_URL = "redis://localhost:6379/1"
+RECOMMENDATION_REFRESH_INTERVAL = 60
+RECOMMENDATION_VECTORS_TTL = 60 * 10
+
+# feed ranking, see user/ranking.py. Candidates are the closest FEED_MAX_CANDIDATES
+# users inside the radius, scored by the weighted terms below
+FEED_MAX_CANDIDATES = 10000
+FEED_RANKING_WEIGHTS = {
+    "distance": 0.4,
+    "interests": 0.35,
+    "online": 0.1,
+    "recency": 0.15,
+}
+FEED_DISTANCE_DECAY_KM = 25
+FEED_RECENCY_DECAY_HOURS = 72
+
+# ranked feeds are cached per user and invalidated per grid cell of
+# FEED_CACHE_CELL_DEGREES, radii covering more than FEED_CACHE_MAX_CELLS cells
+# are invalidated by any change anywhere
+FEED_CACHE_TIMEOUT = 60 * 5
+FEED_CACHE_CELL_DEGREES = 1.0
+FEED_CACHE_MAX_CELLS = 400
+
+# onboarding geocodes cities in the background, see user/geocoding.py. Answers are
+# stored in the CityLocation table and the most recent GEOCODER_LRU_SIZE are also
+# kept in process
+GEOCODER_BACKEND = "user.geocoding.NominatimGeocoder"
+GEOCODER_USER_AGENT = "meetmesh_app"
+GEOCODER_LRU_SIZE = 1024
+# how often a process checks whether manage.py import_gazetteer replaced the
+# gazetteer it holds, see user/gazetteer.py
+GAZETTEER_CHECK_INTERVAL = 60
+
+# proximity alerts, see user/proximity.py. Watchers are bucketed in grids of these
+# cell sizes (in degrees, each dividing 360), a pair is alerted at most once per
+# PROXIMITY_ALERT_COOLDOWN seconds
+PROXIMITY_STORE = "user.proximity.RedisCellStore"
+PROXIMITY_REDIS_URL = "redis://localhost:6379/1"
+PROXIMITY_CELL_DEGREES = [0.05, 0.5, 5, 45]
+PROXIMITY_ALERT_COOLDOWN = 60 * 60 * 6
+
+# live location pings are coalesced per user and written every
+# LOCATION_FLUSH_INTERVAL seconds, see user/location_stream.py
+LOCATION_FLUSH_INTERVAL = 5
+LOCATION_FLUSH_BATCH_SIZE = 1000
+
+# presence, see user/presence.py. Sockets heartbeat every
+# PRESENCE_HEARTBEAT_INTERVAL seconds and count as gone PRESENCE_TTL seconds
+# after their last one
+PRESENCE_REDIS_URL = "redis://localhost:6379/1"
+PRESENCE_HEARTBEAT_INTERVAL = 30
+PRESENCE_TTL = 90
+
+# users behind websocket tokens, see user/auth_cache.py. Each process keeps up to
+# WS_AUTH_LOCAL_SIZE of them for WS_AUTH_LOCAL_TTL seconds, the shared cache for
+# WS_AUTH_CACHE_TTL seconds
+WS_AUTH_LOCAL_SIZE = 10000
+WS_AUTH_LOCAL_TTL = 30
+WS_AUTH_CACHE_TTL = 60 * 5
+
+# chat messages are queued on a Redis stream and stored in batches by
+# manage.py persist_messages, see core/message_queue.py. Redis needs appendonly
+# persistence for queued messages to survive a restart
+CHAT_QUEUE_REDIS_URL = "redis://localhost:6379/4"
+CHAT_STREAM = "chat:messages"
+# how long a client id is remembered for deduplicating retried sends
+CHAT_CLIENT_ID_TTL = 60 * 60 * 24
+# entries read by a persister that stopped are taken over after this long
+CHAT_CLAIM_IDLE_MS = 60 * 1000
+# how often a running persister looks for such entries
+CHAT_CLAIM_INTERVAL = 30
+# an entry that failed to store this many times is moved to CHAT_DEAD_LETTER_STREAM
+CHAT_MAX_DELIVERIES = 5
+CHAT_DEAD_LETTER_STREAM = "chat:messages:dead"
+# longest wait between retries while the database is unreachable
+CHAT_RETRY_MAX_DELAY = 30
+
+CELERY_BEAT_SCHEDULE = {
+    # full recompute, profile changes are picked up incrementally during the day
+    "refresh-recommendations": {
+        "task": "user.tasks.refresh_recommendations",
+        "schedule": crontab(hour=3, minute=0),
+    },
+    "refresh-changed-recommendations": {
+        "task": "user.tasks.refresh_changed_recommendations",
+        "schedule": RECOMMENDATION_REFRESH_INTERVAL,
+    },
+    "flush-last-seen": {
+        "task": "user.tasks.flush_last_seen",
+        "schedule": 60,
+    },
+}
@@ -37,5 +37,31 @@ CORS_ALLOW_CREDENTIALS = True
 STATIC_URL = 'static/'
 
 
+# shared by every worker, feed cache versions and websocket auth rely on it
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env("CACHE_REDIS_URL", default="redis://localhost:6379/3"),
+    },
+}
+
+# group_send has to reach sockets held by every worker, so the layer lives in
+# Redis. Channels and groups are sharded across CHANNEL_REDIS_HOSTS by hash
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {
+            "hosts": env.list("CHANNEL_REDIS_HOSTS", default=["redis://localhost:6379/2"]),
+            "prefix": "meetmesh",
+            # messages waiting per channel before sends to it fail, chat sockets drain quickly
+            "capacity": 200,
+            # seconds an undelivered message is kept
+            "expiry": 30,
+            # seconds a socket stays in a group without rejoining, longer than any connection
+            "group_expiry": 60 * 60 * 24,
+        },
+    },
+}
+
 CELERY_BROKER_URL = "redis://localhost:6379"
 CELERY_RESULT_BACKEND = "redis://localhost:6379"
\ No newline at end of file
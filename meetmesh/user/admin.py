@@ -1,7 +1,7 @@
 from django.contrib import admin
 from leaflet.admin import LeafletGeoAdmin
 
-from .models import User, Profile, UserPreference
+from .models import User, Profile, UserPreference, UserRecommendation, CityLocation, GazetteerPlace
 
 
 @admin.register(User)
@@ -9,4 +9,4 @@ class UserAdmin(LeafletGeoAdmin):
     ordering = ['-created_at']
 
 
-admin.site.register([Profile, UserPreference])
\ No newline at end of file
+admin.site.register([Profile, UserPreference, UserRecommendation, CityLocation, GazetteerPlace])
\ No newline at end of file
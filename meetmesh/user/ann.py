@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+
+class RandomProjectionIndex:
+    """
+    In-process approximate nearest-neighbour index for cosine similarity.
+
+    Every table hashes a vector to the sign pattern of n_bits random hyperplane
+    projections (SimHash), so vectors with a small angle between them tend to
+    share a bucket. A query reranks the union of its buckets exactly. More
+    tables raise recall and latency, more bits shrink buckets and lower both.
+    """
+
+    def __init__(self, n_tables=32, n_bits=12, seed=0):
+        if not 0 < n_bits < 63:
+            raise ValueError("n_bits must be between 1 and 62")
+
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.seed = seed
+
+    def fit(self, vectors):
+        self.vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+        rng = np.random.default_rng(self.seed)
+        self.planes = rng.standard_normal((self.n_tables, self.vectors.shape[1], self.n_bits)).astype(np.float32)
+        self.powers = 1 << np.arange(self.n_bits, dtype=np.int64)
+
+        # a table is its codes sorted, a bucket is then a contiguous slice of `order`
+        self.codes = np.stack([self._hash(self.vectors, table) for table in range(self.n_tables)])
+        self.order = np.argsort(self.codes, axis=1, kind="stable")
+        self.sorted_codes = np.take_along_axis(self.codes, self.order, axis=1)
+        return self
+
+    def query(self, row, top_n=5):
+        """ (neighbour_rows, scores) of an indexed row, best first, excluding the row itself """
+        candidates = self._candidates(self.codes[:, row])
+        candidates = candidates[candidates != row]
+        return self._rerank(self.vectors[row], candidates, top_n)
+
+    def query_vector(self, vector, top_n=5):
+        """ (neighbour_rows, scores) of a vector that is not in the index """
+        vector = normalize(sparse.csr_matrix(vector, dtype=np.float32))
+        codes = np.array([self._hash(vector, table)[0] for table in range(self.n_tables)])
+        return self._rerank(vector, self._candidates(codes), top_n)
+
+    def _hash(self, vectors, table):
+        projections = vectors @ self.planes[table]
+        return (np.asarray(projections) > 0).astype(np.int64) @ self.powers
+
+    def _candidates(self, codes):
+        buckets = []
+        for table, code in enumerate(codes):
+            start, end = np.searchsorted(self.sorted_codes[table], [code, code + 1])
+            buckets.append(self.order[table, start:end])
+
+        return np.unique(np.concatenate(buckets))
+
+    def _rerank(self, vector, candidates, top_n):
+        if not len(candidates):
+            return candidates, np.empty(0, dtype=np.float32)
+
+        # sparse dot product of the query with each candidate row, straight off the CSR arrays
+        starts = self.vectors.indptr[candidates]
+        lengths = self.vectors.indptr[candidates + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        query = np.zeros(self.vectors.shape[1], dtype=np.float32)
+        query[vector.indices] = vector.data
+        products = self.vectors.data[positions] * query[self.vectors.indices[positions]]
+        scores = np.bincount(np.repeat(np.arange(len(candidates)), lengths), weights=products, minlength=len(candidates))
+
+        if len(candidates) > top_n:
+            # keep the top_n and anything tied with them before the full sort
+            keep = scores >= np.partition(scores, len(scores) - top_n)[len(scores) - top_n]
+            candidates, scores = candidates[keep], scores[keep]
+
+        order = np.lexsort((candidates, -scores))[:top_n]
+        return candidates[order], scores[order].astype(np.float32)
@@ -0,0 +1,116 @@
+"""
+Cache of the users behind websocket JWTs.
+
+A handshake looks in a bounded in-process LRU keyed by user id whose entries
+live WS_AUTH_LOCAL_TTL seconds, then in the shared cache, and only then in the
+database, so reconnect storms are answered from memory.
+
+simplejwt only blacklists refresh tokens, the access token a socket presents
+is never in the blacklist itself. Revocation is therefore per user: a token
+issued before the user's latest blacklisted token (a logout, say) is refused,
+which signs every device out of the websocket. Saving a user or blacklisting
+one of their tokens drops their entries here and in the shared cache (see
+user/signals.py), other processes' LRU entries age out within
+WS_AUTH_LOCAL_TTL. While the shared cache is unreachable handshakes go to the
+database instead of failing.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, OuterRef, Subquery
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__file__)
+
+_recent = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+async def get_user(user_id, issued_at):
+    """ the active user of a token issued at `issued_at` (epoch seconds), None when they do not exist or it is revoked """
+    entry = _local_get(user_id)
+    if entry is None:
+        entry = await _cache_get(user_id)
+        if entry is None:
+            entry = await database_sync_to_async(_load_user)(user_id)
+            if entry is None:
+                return None
+            await _cache_set(user_id, entry)
+        _local_set(user_id, entry)
+
+    user, revoked_at = entry
+    # iat has whole seconds, a token from the second of a logout still passes
+    if revoked_at is not None and int(revoked_at.timestamp()) > (issued_at or 0):
+        return None
+    return user
+
+
+def invalidate_user(user_id):
+    """ drop user_id's entries, after they were saved or one of their tokens was blacklisted """
+    with _recent_lock:
+        _recent.pop(user_id, None)
+    try:
+        cache.delete(_user_key(user_id))
+    except RedisError:
+        logger.exception(f"Could not drop the cached websocket user {user_id}")
+
+
+async def _cache_get(user_id):
+    try:
+        return await cache.aget(_user_key(user_id))
+    except RedisError:
+        logger.exception("Could not read the websocket user cache")
+        return None
+
+
+async def _cache_set(user_id, entry):
+    try:
+        await cache.aset(_user_key(user_id), entry, settings.WS_AUTH_CACHE_TTL)
+    except RedisError:
+        logger.exception("Could not write the websocket user cache")
+
+
+def _load_user(user_id):
+    """ (user, when their latest token was blacklisted) in one query, None for unknown or inactive users """
+    from django.contrib.auth import get_user_model
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+    revoked = BlacklistedToken.objects.filter(token__user_id=OuterRef("pk")).order_by().values(
+        "token__user_id"
+    ).annotate(latest=Max("blacklisted_at")).values("latest")
+    user = get_user_model().objects.filter(id=user_id, is_active=True).annotate(
+        tokens_revoked_at=Subquery(revoked)
+    ).first()
+    if user is None:
+        return None
+    return user, user.tokens_revoked_at
+
+
+def _local_get(user_id):
+    with _recent_lock:
+        entry = _recent.get(user_id)
+        if entry is None:
+            return None
+        cached, expires = entry
+        if expires < time.monotonic():
+            del _recent[user_id]
+            return None
+        _recent.move_to_end(user_id)
+        return cached
+
+
+def _local_set(user_id, entry):
+    with _recent_lock:
+        _recent[user_id] = (entry, time.monotonic() + settings.WS_AUTH_LOCAL_TTL)
+        _recent.move_to_end(user_id)
+        while len(_recent) > settings.WS_AUTH_LOCAL_SIZE:
+            _recent.popitem(last=False)
+
+
+def _user_key(user_id):
+    return f"ws_auth_user.{user_id}"
@@ -1,62 +1,236 @@
-import json
-from channels.generic.websocket import JsonWebsocketConsumer
+import asyncio
+import logging
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
 from channels.generic.http import AsyncHttpConsumer
-
-class DBHelper:
-    def set_user_channel_name(self):
-        from .models import User
-
-        user = self.user
-        if user.channel_name != self.channel_name:
-            user.channel_name = self.channel_name
-
-    def clear_user_channel_name(self):
-        from .models import User
-
-        user = self.user
-        if user.is_authenticated and user.channel_name:
-            user.channel_name = None
-
-class ChatConsumer(JsonWebsocketConsumer, DBHelper):
-    def connect(self):
-        from .models import User
-
-        self.accept()
-
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from redis.exceptions import RedisError
+
+from core import message_queue
+from core.models import Conversation, ConversationSummary
+from core.serializers import MessageSerializer
+from utilities.utils import generate_uuid
+from . import presence
+
+logger = logging.getLogger(__file__)
+
+
+class ChatConsumer(AsyncJsonWebsocketConsumer):
+    """
+    Chat over ws/chat/. Every frame is a JSON object with a "type":
+
+    - {"type": "message.send", "conversation": id, "content": .., "client_id": ..}
+      answered with {"type": "message.ack", "client_id": .., "id": .., "conversation": id}.
+      "receiver": user id instead of "conversation" starts or reuses the room with that user.
+    - {"type": "typing", "conversation": id, "is_typing": true}
+    - {"type": "message.read", "conversation": id}
+
+    The other participant's sockets (and the sender's other devices) get
+    {"type": "message" | "typing" | "message.read", "conversation": id, ..}, a
+    frame that cannot be handled gets {"type": "error", "error": ..}.
+    """
+    async def connect(self):
         self.user = self.scope.get("user")
 
-        if self.user and self.user.is_authenticated:
-            self.conversations = set(self.get_user_conversations())
+        if not (self.user and self.user.is_authenticated):
+            await self.close()
+            return
 
-            if self.conversations:
-                for conv_id in self.conversations:
-                    group_name = f"conversation_{conv_id}"
-                    self.channel_layer.group_add(group_name, self.channel_name)
-                    print(f"Added to group: {group_name}")
+        # one group per user, messages of every conversation (and every device) go through it
+        await self.channel_layer.group_add(self.user.group_name, self.channel_name)
+        await self.accept()
+        self.heartbeats = asyncio.create_task(self.send_heartbeats())
+        # conversation id -> the other participant's group, filled on first use
+        self.partners = {}
 
-            self.set_user_channel_name()
+    async def disconnect(self, code):
+        if self.user and self.user.is_authenticated:
+            self.heartbeats.cancel()
+            await self.channel_layer.group_discard(self.user.group_name, self.channel_name)
+            try:
+                await presence.disconnect(self.user.id, self.channel_name)
+            except RedisError:
+                logger.exception(f"Could not record the disconnect of {self.user.id}")
+
+    async def send_heartbeats(self):
+        """ keep this socket counted in the user's presence until it disconnects """
+        while True:
+            try:
+                await presence.heartbeat(self.user.id, self.channel_name)
+            except RedisError:
+                logger.exception(f"Could not record the heartbeat of {self.user.id}")
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # a malformed frame is answered instead of closing the socket
+        try:
+            content = await self.decode_json(text_data)
+        except (TypeError, ValueError):
+            await self.send_error("Frames must be JSON text")
+            return
+        await self.receive_json(content, **kwargs)
+
+    async def receive_json(self, content, **kwargs):
+        handler = self.handlers.get(content.get("type")) if isinstance(content, dict) else None
+        if handler is None:
+            await self.send_error("Unknown message type")
+            return
+        await handler(self, content)
+
+    async def send_message(self, content):
+        serializer = MessageSerializer.MessageSendSerializer(data=content)
+        if not serializer.is_valid():
+            await self.send_error(serializer.errors, content.get("client_id"))
+            return
+
+        if content.get("receiver"):
+            conversation_id = await self.get_room(content["receiver"])
         else:
-            self.close()
+            conversation_id = content.get("conversation")
+        partner_group = await self.get_partner_group(conversation_id)
+        if partner_group is None:
+            await self.send_error("Conversation not found", content.get("client_id"))
+            return
+
+        # generated here when the client sent none, so the ack can still be matched to the send
+        client_id = serializer.validated_data.get("client_id") or generate_uuid()
+        # the database write happens in manage.py persist_messages, see core/message_queue.py
+        message_id, created = await message_queue.aenqueue(
+            conversation_id, self.user.id, serializer.validated_data["content"], client_id
+        )
+        await self.send_json({"type": "message.ack", "client_id": client_id, "id": message_id, "conversation": conversation_id})
+
+        if created:
+            event = {
+                "type": "chat.message",
+                "conversation": conversation_id,
+                "id": message_id,
+                "client_id": client_id,
+                "sender": self.user.id,
+                "message": serializer.validated_data["content"],
+            }
+            for group in {self.user.group_name, partner_group}:
+                await self.channel_layer.group_send(group, event)
+
+    async def send_typing(self, content):
+        partner_group = await self.get_partner_group(content.get("conversation"))
+        if partner_group is None:
+            await self.send_error("Conversation not found")
+            return
+
+        await self.channel_layer.group_send(partner_group, {
+            "type": "chat.typing",
+            "conversation": content["conversation"],
+            "user": self.user.id,
+            "is_typing": bool(content.get("is_typing", True)),
+        })
+
+    async def send_read(self, content):
+        conversation_id = content.get("conversation")
+        partner_group = await self.get_partner_group(conversation_id)
+        if partner_group is None:
+            await self.send_error("Conversation not found")
+            return
+
+        read_at = await database_sync_to_async(ConversationSummary.mark_read)(conversation_id, self.user)
+        event = {"type": "chat.read", "conversation": conversation_id, "user": self.user.id, "read_at": read_at.isoformat()}
+        for group in {self.user.group_name, partner_group}:
+            await self.channel_layer.group_send(group, event)
+
+    handlers = {
+        "message.send": send_message,
+        "typing": send_typing,
+        "message.read": send_read,
+    }
+
+    async def send_error(self, error, client_id=None):
+        await self.send_json({"type": "error", "error": error, "client_id": client_id})
+
+    async def get_partner_group(self, conversation_id):
+        """ the group of the other participant of conversation_id, None when this user is not in it """
+        if not isinstance(conversation_id, str):
+            return None
+        if conversation_id not in self.partners:
+            participants = await database_sync_to_async(list)(
+                Conversation.participants.through.objects.filter(conversation_id=conversation_id).values_list("user_id", flat=True)
+            )
+            if self.user.id not in participants:
+                return None
+            partner_id = next((user_id for user_id in participants if user_id != self.user.id), self.user.id)
+            self.partners[conversation_id] = f"user_{partner_id}"
+        return self.partners[conversation_id]
+
+    @database_sync_to_async
+    def get_room(self, receiver_id):
+        receiver = get_user_model().objects.filter(id=receiver_id, is_active=True).first()
+        if receiver is None:
+            return None
+        room = Conversation.get_room(receiver, self.user)
+        self.partners[room.id] = receiver.group_name
+        return room.id
+
+    async def chat_message(self, event):
+        await self.send_json({
+            "type": "message",
+            "conversation": event["conversation"],
+            "id": event["id"],
+            "client_id": event.get("client_id"),
+            "sender": event.get("sender"),
+            "message": event["message"],
+        })
+
+    async def chat_typing(self, event):
+        await self.send_json({
+            "type": "typing",
+            "conversation": event["conversation"],
+            "user": event["user"],
+            "is_typing": event["is_typing"],
+        })
+
+    async def chat_read(self, event):
+        await self.send_json({
+            "type": "message.read",
+            "conversation": event["conversation"],
+            "user": event["user"],
+            "read_at": event["read_at"],
+        })
+
+
+class LocationConsumer(AsyncJsonWebsocketConsumer):
+    """ live location pings, {"longitude": .., "latitude": ..}, see user/location_stream.py """
+
+    async def connect(self):
+        self.user = self.scope.get("user")
 
-    def disconnect(self, code):
         if self.user and self.user.is_authenticated:
-            for conv_id in getattr(self, "conversations", []):
-                self.channel_layer.group_discard(f"conversation_{conv_id}", self.channel_name)
-            self.clear_user_channel_name()
-
-    def receive(self, text_data=None, bytes_data=None, **kwargs):
-        return super().receive(text_data, bytes_data, **kwargs)
-
-    def get_user_conversations(self):
-        return list(self.user.conversations.values_list("id", flat=True))
-    
-    def send_mesage(self, event):
-        message = event['message']
-
-        # Send message to WebSocket
-        self.send(text_data=json.dumps({
-            'message': message
-        }))
+            await self.accept()
+        else:
+            await self.close()
+
+    async def receive(self, text_data=None, bytes_data=None, **kwargs):
+        # a malformed frame is answered instead of closing the socket
+        try:
+            content = await self.decode_json(text_data)
+        except (TypeError, ValueError):
+            await self.send_error("Frames must be JSON text")
+            return
+        await self.receive_json(content, **kwargs)
+
+    async def receive_json(self, content, **kwargs):
+        from .location_stream import location_buffer
+
+        try:
+            longitude, latitude = float(content["longitude"]), float(content["latitude"])
+        except (KeyError, TypeError, ValueError):
+            await self.send_json({"error": "longitude and latitude are required"})
+            return
+
+        if not (-180 <= longitude <= 180 and -90 <= latitude <= 90):
+            await self.send_json({"error": "longitude or latitude out of range"})
+            return
+
+        location_buffer.add(self.user.id, longitude, latitude)
 
 
 class NotificationConsumer(AsyncHttpConsumer):
@@ -0,0 +1,146 @@
+"""
+Per-user cache of ranked feeds.
+
+A cached feed is keyed by the user, their rounded location, the radius, their
+preference version and the versions of the grid cells the radius covers. Any
+change that can alter a feed bumps a version (see user/signals.py), so stale
+entries are never read by a new feed and simply expire. A scroll that started
+on an entry keeps paging through it (see FeedPagination), so it is never
+ranked twice. While the cache is unreachable feeds are ranked on every request.
+"""
+import hashlib
+import logging
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from redis.exceptions import RedisError
+
+from .ranking import FeedCandidate, rank_feed
+
+HITS_KEY = "feed_cache.hits"
+MISSES_KEY = "feed_cache.misses"
+WORLD_CELL = "world"
+
+logger = logging.getLogger(__file__)
+
+
+def get_ranked_feed(user, location, radius_km, candidates):
+    """ rank_feed(user, candidates), served from the cache when nothing nearby changed """
+    return get_ranked_feed_snapshot(user, location, radius_km, candidates)[1]
+
+
+def get_ranked_feed_snapshot(user, location, radius_km, candidates):
+    """
+    (cache key, ranked feed), the key reads the same ranking back with
+    load_ranked_feed. The key is None when the ranking could not be cached.
+    """
+    try:
+        key = feed_cache_key(user, location, radius_km)
+        ranked = cache.get(key)
+    except RedisError:
+        logger.exception("Could not read the feed cache")
+        return None, rank_feed(user, candidates)
+
+    if ranked is not None:
+        _incr(HITS_KEY)
+        return key, [FeedCandidate(*candidate) for candidate in ranked]
+
+    _incr(MISSES_KEY)
+    ranked = rank_feed(user, candidates)
+    try:
+        cache.set(key, [tuple(candidate) for candidate in ranked], settings.FEED_CACHE_TIMEOUT)
+    except RedisError:
+        logger.exception("Could not write the feed cache")
+        return None, ranked
+    return key, ranked
+
+
+def load_ranked_feed(key):
+    """ the ranking stored under key, kept alive while it is being scrolled, None once expired """
+    try:
+        ranked = cache.get(key)
+        if ranked is None:
+            return None
+        cache.touch(key, settings.FEED_CACHE_TIMEOUT)
+    except RedisError:
+        logger.exception("Could not read the feed cache")
+        return None
+    return [FeedCandidate(*candidate) for candidate in ranked]
+
+
+def feed_cache_key(user, location, radius_km):
+    cells = covering_cells(location, radius_km)
+    versions = cache.get_many([_cell_version_key(cell) for cell in cells])
+    parts = [
+        str(user.id),
+        f"{location.x:.2f},{location.y:.2f}",
+        str(radius_km),
+        # what the user may see depends on these, see CustomUserManager.discoverable_by
+        f"{user.is_verified:d}{user.has_completed_onboarding:d}",
+        str(cache.get(_preference_version_key(user.id), 0)),
+        *(str(versions.get(_cell_version_key(cell), 0)) for cell in cells),
+    ]
+    return "feed." + hashlib.sha1("|".join(parts).encode()).hexdigest()
+
+
+def covering_cells(location, radius_km):
+    """ grid cells overlapping the bounding box of the radius around location """
+    size = settings.FEED_CACHE_CELL_DEGREES
+    lat_span = radius_km / 111.0
+    lng_span = radius_km / (111.0 * max(math.cos(math.radians(location.y)), 0.01))
+
+    xs = range(math.floor((location.x - lng_span) / size), math.floor((location.x + lng_span) / size) + 1)
+    ys = range(
+        math.floor(max(location.y - lat_span, -90) / size),
+        math.floor(min(location.y + lat_span, 90) / size) + 1,
+    )
+    if len(xs) * len(ys) > settings.FEED_CACHE_MAX_CELLS:
+        return [WORLD_CELL]
+    return [(x, y) for x in xs for y in ys]
+
+
+def cell_of(location):
+    size = settings.FEED_CACHE_CELL_DEGREES
+    return math.floor(location.x / size), math.floor(location.y / size)
+
+
+def invalidate_location(location):
+    """ drop every cached feed that can contain a user at `location` """
+    if location is None:
+        return
+    _incr(_cell_version_key(cell_of(location)))
+    _incr(_cell_version_key(WORLD_CELL))
+
+
+def invalidate_preferences(user_id):
+    """ drop the cached feeds of `user_id`, e.g. after their preferences changed """
+    _incr(_preference_version_key(user_id))
+
+
+def feed_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else None,
+    }
+
+
+def _cell_version_key(cell):
+    return f"feed_cell_version.{cell if cell == WORLD_CELL else '%s.%s' % cell}"
+
+
+def _preference_version_key(user_id):
+    return f"feed_preference_version.{user_id}"
+
+
+def _incr(key):
+    # a lost version bump leaves feeds stale for at most FEED_CACHE_TIMEOUT, a lost count only skews the stats
+    try:
+        cache.add(key, 0, None)
+        cache.incr(key)
+    except RedisError:
+        logger.exception(f"Could not increment {key}")
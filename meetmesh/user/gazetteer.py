@@ -0,0 +1,144 @@
+"""
+Offline city gazetteer.
+
+Cities imported from a GeoNames dump (manage.py import_gazetteer) are held in
+memory per process, so resolving a (country, city) pair is a dict lookup,
+prefix search a bisect over the sorted names and fuzzy matching a difflib
+comparison against names sharing the first letter.
+
+An import bumps a version in the shared cache, which every process checks at
+most every GAZETTEER_CHECK_INTERVAL seconds and reloads on when it changed.
+"""
+import bisect
+import difflib
+import threading
+import time
+import unicodedata
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django_countries import countries
+
+from .models import GazetteerPlace
+
+GazetteerMatch = namedtuple("GazetteerMatch", ["name", "country", "longitude", "latitude", "population"])
+
+FUZZY_CUTOFF = 0.85
+VERSION_KEY = "gazetteer.version"
+
+# (version, gazetteer, checked at), see get_gazetteer
+_loaded = None
+_loaded_lock = threading.Lock()
+
+
+def search_key(name):
+    """ casefolded, accent free and whitespace collapsed, "  São Paulo" -> "sao paulo" """
+    decomposed = unicodedata.normalize("NFKD", " ".join(name.split()).casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def country_code(country):
+    """ ISO alpha-2 code of a country code or name, None when unknown """
+    if not country:
+        return None
+    country = str(country).strip()
+    if len(country) == 2:
+        return country.upper()
+    return countries.by_name(country) or None
+
+
+class Gazetteer:
+
+    def __init__(self, places):
+        """ places: iterable of GazetteerMatch """
+        self.places = defaultdict(list)
+        for place in places:
+            self.places[search_key(place.name)].append(place)
+        for matches in self.places.values():
+            matches.sort(key=lambda place: -place.population)
+
+        self.keys = sorted(self.places)
+        self.keys_by_initial = defaultdict(list)
+        for key in self.keys:
+            self.keys_by_initial[key[:1]].append(key)
+
+    def __len__(self):
+        return sum(len(matches) for matches in self.places.values())
+
+    def resolve(self, city, country=None, fuzzy=True):
+        """ the most populous place named city in country, or the closest name with fuzzy=True """
+        key = search_key(city)
+        match = self._best(self.places.get(key, ()), country)
+        if match is not None or not fuzzy:
+            return match
+
+        names = self.keys_by_initial.get(key[:1], ())
+        for name in difflib.get_close_matches(key, names, n=5, cutoff=FUZZY_CUTOFF):
+            match = self._best(self.places[name], country)
+            if match is not None:
+                return match
+        return None
+
+    def search(self, prefix, country=None, limit=10):
+        """ places whose name starts with prefix, most populous first """
+        prefix = search_key(prefix)
+        if not prefix:
+            return []
+
+        code = country_code(country)
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + "\uffff")
+        matches = [
+            place for key in self.keys[start:end] for place in self.places[key]
+            if code is None or place.country == code
+        ]
+        return sorted(matches, key=lambda place: -place.population)[:limit]
+
+    @staticmethod
+    def _best(matches, country):
+        code = country_code(country)
+        return next((place for place in matches if code is None or place.country == code), None)
+
+
+def get_gazetteer():
+    """ the process wide gazetteer, reloaded once an import changed the table """
+    global _loaded
+    with _loaded_lock:
+        now = time.monotonic()
+        if _loaded is not None and now - _loaded[2] < settings.GAZETTEER_CHECK_INTERVAL:
+            return _loaded[1]
+
+        version = cache.get(VERSION_KEY, 0)
+        if _loaded is None or _loaded[0] != version:
+            _loaded = (version, load_gazetteer(), now)
+        else:
+            _loaded = (version, _loaded[1], now)
+        return _loaded[1]
+
+
+def load_gazetteer():
+    return Gazetteer(
+        GazetteerMatch(name, country, location.x, location.y, population)
+        for name, country, location, population in GazetteerPlace.objects.values_list(
+            "name", "country", "location", "population"
+        ).iterator(chunk_size=5000)
+    )
+
+
+def invalidate():
+    """ make every process reload the gazetteer, after the GazetteerPlace table changed """
+    global _loaded
+    cache.add(VERSION_KEY, 0, None)
+    cache.incr(VERSION_KEY)
+    with _loaded_lock:
+        _loaded = None
+
+
+def resolve(city, country=None):
+    """ Point of city from the gazetteer, None when it is not in it """
+    match = get_gazetteer().resolve(city, country)
+    if match is None:
+        return None
+    return Point(match.longitude, match.latitude, srid=4326)
@@ -0,0 +1,98 @@
+"""
+City geocoding for onboarding.
+
+Lookups go through the offline gazetteer (user/gazetteer.py), an in-process
+LRU, then the CityLocation table, and only then the configured geocoder
+backend (GEOCODER_BACKEND), whose answer is stored so every city is geocoded
+once.
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.gis.geos import Point
+from django.db import IntegrityError, transaction
+from django.utils.module_loading import import_string
+
+from . import gazetteer
+from .models import CityLocation
+
+_recent = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+class NominatimGeocoder:
+    """ OpenStreetMap's Nominatim, one request per call """
+
+    def __init__(self):
+        from geopy.geocoders import Nominatim
+        self.geolocator = Nominatim(user_agent=settings.GEOCODER_USER_AGENT)
+
+    def geocode(self, city):
+        location = self.geolocator.geocode(city)
+        if location is None:
+            return None
+        return Point(location.longitude, location.latitude, srid=4326)
+
+
+class StaticGeocoder:
+    """ answers from settings.GEOCODER_STATIC_LOCATIONS ({city: (longitude, latitude)}), for tests and local development """
+
+    def geocode(self, city):
+        locations = {normalize(name): point for name, point in getattr(settings, "GEOCODER_STATIC_LOCATIONS", {}).items()}
+        if normalize(city) not in locations:
+            return None
+        return Point(*locations[normalize(city)], srid=4326)
+
+
+def get_geocoder():
+    return import_string(settings.GEOCODER_BACKEND)()
+
+
+def normalize(city):
+    return " ".join(city.split()).casefold()
+
+
+def lookup(city, country=None):
+    """ the CityLocation of city, or None when it is not known locally. Never calls the geocoder """
+    name = normalize(city)
+    location = gazetteer.resolve(city, country)
+    if location is not None:
+        return CityLocation(name=name, location=location)
+
+    with _recent_lock:
+        if name in _recent:
+            _recent.move_to_end(name)
+            return _recent[name]
+
+    place = CityLocation.objects.filter(name=name).first()
+    if place is not None:
+        _remember(place)
+    return place
+
+
+def geocode(city, country=None, geocoder=None):
+    """ the CityLocation of city, asking the geocoder and storing its answer when it is not known yet """
+    place = lookup(city, country)
+    if place is not None:
+        return place
+
+    name = normalize(city)
+    location = (geocoder or get_geocoder()).geocode(name)
+    try:
+        with transaction.atomic():
+            place = CityLocation.objects.create(name=name, location=location)
+    except IntegrityError:
+        # geocoded concurrently by another worker
+        place = CityLocation.objects.get(name=name)
+
+    _remember(place)
+    return place
+
+
+def _remember(place):
+    with _recent_lock:
+        _recent[place.name] = place
+        _recent.move_to_end(place.name)
+        while len(_recent) > settings.GEOCODER_LRU_SIZE:
+            _recent.popitem(last=False)
@@ -0,0 +1,69 @@
+"""
+Buffered ingestion of live location pings.
+
+Pings only overwrite the latest position of their user in memory. While
+anything is pending, the buffer is flushed every LOCATION_FLUSH_INTERVAL
+seconds with one UPDATE ... FROM (VALUES ...) per LOCATION_FLUSH_BATCH_SIZE
+users, so a stored current_location is at most that many seconds stale and
+the database sees one write per user per interval however often clients ping.
+"""
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__file__)
+
+
+class LocationBuffer:
+
+    def __init__(self):
+        self.pending = {}
+        self.flusher = None
+
+    def add(self, user_id, longitude, latitude):
+        self.pending[user_id] = (longitude, latitude)
+        if self.flusher is None or self.flusher.done():
+            self.flusher = asyncio.get_running_loop().create_task(self.run())
+
+    async def run(self):
+        while self.pending:
+            await asyncio.sleep(settings.LOCATION_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        locations, self.pending = self.pending, {}
+        if not locations:
+            return
+        try:
+            await database_sync_to_async(write_locations)(locations)
+        except Exception:
+            logger.exception(f"Could not store {len(locations)} locations")
+
+
+def write_locations(locations):
+    """ store {user_id: (longitude, latitude)} as current_location and alert nearby watchers """
+    from .models import User
+    from .tasks import proximity_alerts
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    column = connection.ops.quote_name(User._meta.get_field("current_location").column)
+    srid = User._meta.get_field("current_location").srid
+    rows = [(user_id, longitude, latitude) for user_id, (longitude, latitude) in locations.items()]
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        for start in range(0, len(rows), settings.LOCATION_FLUSH_BATCH_SIZE):
+            batch = rows[start:start + settings.LOCATION_FLUSH_BATCH_SIZE]
+            values = ", ".join(["(%s, %s::double precision, %s::double precision)"] * len(batch))
+            cursor.execute(
+                f"UPDATE {table} AS u SET {column} = ST_SetSRID(ST_MakePoint(v.longitude, v.latitude), {srid:d}) "
+                f"FROM (VALUES {values}) AS v (id, longitude, latitude) WHERE u.id = v.id",
+                [value for row in batch for value in row]
+            )
+        # the bulk UPDATE skips model signals, so alerts are queued here
+        transaction.on_commit(lambda: proximity_alerts.delay(rows))
+
+
+location_buffer = LocationBuffer()
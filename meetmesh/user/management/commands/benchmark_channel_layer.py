@@ -0,0 +1,125 @@
+import asyncio
+import multiprocessing
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def run_worker(config, sockets, groups, ready, results):
+    """ one Daphne worker's share of the sockets, all reading from the shared layer """
+    from channels_redis.core import RedisChannelLayer
+
+    async def main():
+        layer = RedisChannelLayer(**config)
+        channels = [await layer.new_channel() for _ in range(sockets)]
+        await asyncio.gather(*(
+            layer.group_add(f"conversation_{index % groups}", channel) for index, channel in enumerate(channels)
+        ))
+        ready.release()
+
+        received, last = 0, time.time()
+
+        async def drain(channel):
+            nonlocal received, last
+            while (await layer.receive(channel))["type"] != "benchmark.stop":
+                received, last = received + 1, time.time()
+
+        await asyncio.gather(*(drain(channel) for channel in channels))
+        results.put((received, last))
+
+    asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure group_send fan-out through the Redis channel layer with several worker processes "
+        "holding chat sockets, like Daphne workers behind a load balancer"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Worker processes holding sockets (default: 4)'
+        )
+        parser.add_argument(
+            '--sockets', type=int, default=250,
+            help='Sockets per worker (default: 250)'
+        )
+        parser.add_argument(
+            '--groups', type=int, default=100,
+            help='Conversation groups the sockets are spread over (default: 100)'
+        )
+        parser.add_argument(
+            '--messages', type=int, default=5000,
+            help='Number of group_send calls (default: 5000)'
+        )
+        parser.add_argument(
+            '--fake', action='store_true',
+            help='Run against an in-process fakeredis server instead of CHANNEL_LAYERS'
+        )
+
+    def handle(self, *args, **options):
+        workers, sockets, groups = options['workers'], options['sockets'], options['groups']
+        config = self.layer_config(options['fake'])
+
+        # group_send goes round robin over the groups, every socket gets the messages of its group
+        sends = [options['messages'] // groups + (group < options['messages'] % groups) for group in range(groups)]
+        expected = workers * sum(sends[index % groups] for index in range(sockets))
+
+        context = multiprocessing.get_context("fork")
+        ready, results = context.Semaphore(0), context.Queue()
+        processes = [
+            context.Process(target=run_worker, args=(config, sockets, groups, ready, results))
+            for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            ready.acquire()
+
+        started = time.time()
+        sent = asyncio.run(self.send(config, options['messages'], groups)) - started
+
+        reports = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        delivered = sum(received for received, _ in reports)
+        elapsed = max(last for _, last in reports) - started
+        self.stdout.write(
+            f"{options['messages']} group_send in {sent:.2f}s ({options['messages'] / sent:.0f}/s), "
+            f"{delivered}/{expected} deliveries to {workers * sockets} sockets on {workers} workers "
+            f"in {elapsed:.2f}s ({delivered / elapsed:.0f} messages/s)"
+        )
+
+    async def send(self, config, messages, groups):
+        from channels_redis.core import RedisChannelLayer
+
+        layer = RedisChannelLayer(**config)
+        for index in range(messages):
+            await layer.group_send(f"conversation_{index % groups}", {"type": "chat.message", "message": str(index)})
+        finished = time.time()
+
+        for group in range(groups):
+            await layer.group_send(f"conversation_{group}", {"type": "benchmark.stop"})
+        return finished
+
+    def layer_config(self, fake):
+        if fake:
+            from fakeredis import TcpFakeServer
+
+            server = TcpFakeServer(("127.0.0.1", 0), bind_and_activate=False)
+            # the default listen backlog of 5 resets connections when every worker connects at once
+            server.request_queue_size = 1024
+            server.server_bind()
+            server.server_activate()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            return {"hosts": ["redis://%s:%s/0" % server.server_address], "prefix": "benchmark", "capacity": 10000}
+
+        layer = settings.CHANNEL_LAYERS.get("default", {})
+        if layer.get("BACKEND") != "channels_redis.core.RedisChannelLayer":
+            raise CommandError("CHANNEL_LAYERS is not a Redis layer, use production settings or --fake")
+        # sockets read as fast as they can, the capacity only has to hold the backlog
+        return {**layer.get("CONFIG", {}), "prefix": "benchmark", "capacity": 10000}
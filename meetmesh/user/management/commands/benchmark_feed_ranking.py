@@ -0,0 +1,89 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from user.models import User
+from user.ranking import candidate_rows, rank_feed, score_candidates, user_interest_set
+
+
+class Command(BaseCommand):
+    help = "Measure feed ranking latency over a synthetic candidate set, or end to end for a real user"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--candidates', type=int, default=10000,
+            help='Number of candidates scored per run (default: 10000)'
+        )
+        parser.add_argument(
+            '--runs', type=int, default=200,
+            help='Number of timed runs (default: 200)'
+        )
+        parser.add_argument(
+            '--user', default=None,
+            help='Email of a user with a base location, times the candidate query and rank_feed for their feed'
+        )
+        parser.add_argument(
+            '--radius', type=float, default=None,
+            help='Feed radius in km with --user (default: their notify_radius_km, or 1000)'
+        )
+
+    def handle(self, *args, **options):
+        if options['user']:
+            self.benchmark_user(options)
+            return
+
+        total = options['candidates']
+        rng = np.random.default_rng(0)
+        now = time.time()
+
+        # what rank_feed gets back from the candidate query
+        distances_km = rng.uniform(0, 500, total)
+        interest_counts = rng.integers(0, 10, total)
+        shared_interests = rng.binomial(interest_counts, 0.3)
+        is_online = rng.random(total) < 0.2
+        last_seen = now - rng.exponential(3600 * 48, total)
+        last_seen[rng.random(total) < 0.1] = np.nan
+        ids = np.array([f"user-{index}" for index in range(total)])
+
+        timings = []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            scores = score_candidates(
+                distances_km, shared_interests, interest_counts, 5, is_online, last_seen, now=now
+            )
+            np.lexsort((ids, -scores))
+            timings.append(time.perf_counter() - started)
+
+        self.report(f"{total} candidates", timings)
+
+    def benchmark_user(self, options):
+        """ what the feeds endpoint pays on a cache miss, the SQL candidate fetch included """
+        user = User.objects.select_related('profile', 'user_preference').get(email=options['user'])
+        if not user.base_location:
+            self.stderr.write(f"{user.email} has no base location")
+            return
+
+        radius_km = options['radius'] or getattr(user.user_preference, "notify_radius_km", None) or 1000
+        candidates = User.objects.nearby(user.base_location, radius_km, viewer=user).exclude(id=user.id)
+        user_interests = user_interest_set(user)
+
+        fetch_timings, rank_timings = [], []
+        for _ in range(options['runs']):
+            started = time.perf_counter()
+            rows = candidate_rows(candidates, user_interests)
+            fetch_timings.append(time.perf_counter() - started)
+
+            started = time.perf_counter()
+            rank_feed(user, candidates)
+            rank_timings.append(time.perf_counter() - started)
+
+        self.report(f"candidate query ({len(rows)} rows)", fetch_timings)
+        self.report("rank_feed (query and scoring)", rank_timings)
+
+    def report(self, name, timings):
+        timings = np.array(timings) * 1000
+        self.stdout.write(
+            f"{name}: p50={np.percentile(timings, 50):.2f}ms "
+            f"p95={np.percentile(timings, 95):.2f}ms max={timings.max():.2f}ms"
+        )
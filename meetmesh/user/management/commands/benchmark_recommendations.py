@@ -0,0 +1,106 @@
+import time
+
+import numpy as np
+from scipy import sparse
+from django.core.management.base import BaseCommand
+from sklearn.preprocessing import normalize
+
+from user.ann import RandomProjectionIndex
+from user.recommendation import generate_user_vectors
+
+
+class Command(BaseCommand):
+    help = "Compare recall@K and query latency of the ANN recommendation index against the exact path"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=20000,
+            help='Number of synthetic users (default: 20000)'
+        )
+        parser.add_argument(
+            '--from-db', action='store_true',
+            help='Use the real profile vectors instead of synthetic ones'
+        )
+        parser.add_argument(
+            '--queries', type=int, default=500,
+            help='Number of users to query (default: 500)'
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='K in recall@K (default: 10)'
+        )
+        parser.add_argument(
+            '--tables', type=int, nargs='+', default=[8, 16, 32, 48],
+            help='ANN table counts to try (default: 8 16 32 48)'
+        )
+        parser.add_argument(
+            '--bits', type=int, default=12,
+            help='Hash bits per table (default: 12)'
+        )
+
+    def handle(self, *args, **options):
+        if options['from_db']:
+            vectors, _, _ = generate_user_vectors()
+        else:
+            vectors = self.synthetic_vectors(options['users'])
+
+        vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+        top = options['top']
+        rng = np.random.default_rng(0)
+        queries = rng.choice(vectors.shape[0], size=min(options['queries'], vectors.shape[0]), replace=False)
+
+        # exact path, one query row at a time
+        exact_thresholds, timings = [], []
+        for row in queries:
+            started = time.perf_counter()
+            scores = (vectors @ vectors[row].T).toarray().ravel()
+            scores[row] = -np.inf
+            threshold = np.partition(scores, -top)[-top]
+            timings.append(time.perf_counter() - started)
+            exact_thresholds.append(threshold)
+
+        self.report("exact", 1.0, timings)
+
+        for n_tables in options['tables']:
+            started = time.perf_counter()
+            index = RandomProjectionIndex(n_tables=n_tables, n_bits=options['bits']).fit(vectors)
+            build_time = time.perf_counter() - started
+
+            recalls, timings = [], []
+            for row, threshold in zip(queries, exact_thresholds):
+                started = time.perf_counter()
+                _, scores = index.query(row, top)
+                timings.append(time.perf_counter() - started)
+                # tie-aware: any neighbour scoring at least the exact K-th score is a hit
+                recalls.append(np.count_nonzero(scores >= threshold - 1e-6) / top)
+
+            self.report(f"ann tables={n_tables} bits={options['bits']} (built in {build_time:.2f}s)", np.mean(recalls), timings)
+
+    def report(self, name, recall, timings):
+        timings = np.array(timings) * 1000
+        self.stdout.write(
+            f"{name}: recall@K={recall:.3f} "
+            f"p50={np.percentile(timings, 50):.3f}ms p95={np.percentile(timings, 95):.3f}ms"
+        )
+
+    def synthetic_vectors(self, users, cities=20, occupations=200, interests=300, interests_per_user=5):
+        """ one city, one occupation and a handful of interests per user, like real profiles """
+        rng = np.random.default_rng(1)
+        # popular interests are picked more often
+        popularity = 1 / np.arange(1, interests + 1)
+        popularity /= popularity.sum()
+
+        rows, columns = [], []
+        for user in range(users):
+            features = [
+                rng.integers(cities),
+                cities + rng.integers(occupations),
+                *(cities + occupations + rng.choice(interests, size=interests_per_user, replace=False, p=popularity)),
+            ]
+            rows.extend([user] * len(features))
+            columns.extend(features)
+
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, columns)),
+            shape=(users, cities + occupations + interests),
+        )
@@ -0,0 +1,76 @@
+import csv
+import io
+import sys
+import zipfile
+
+from django.contrib.gis.geos import Point
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from user import gazetteer
+from user.models import GazetteerPlace
+
+# columns of a GeoNames dump, http://download.geonames.org/export/dump/readme.txt
+GEONAME_ID, NAME, LATITUDE, LONGITUDE, FEATURE_CLASS, COUNTRY, POPULATION = 0, 1, 4, 5, 6, 8, 14
+
+
+class Command(BaseCommand):
+    help = "Replace the offline gazetteer with the populated places of a GeoNames dump (e.g. cities15000.zip)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='GeoNames .txt or .zip dump')
+        parser.add_argument(
+            '--countries', nargs='+', default=None,
+            help='Only import these ISO country codes (default: all)'
+        )
+        parser.add_argument(
+            '--min-population', type=int, default=0,
+            help='Skip places with fewer inhabitants (default: 0)'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Number of places inserted per query (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        countries = {code.upper() for code in options['countries']} if options['countries'] else None
+        batch_size = options['batch_size']
+
+        with self.open_dump(options['path']) as dump, transaction.atomic():
+            GazetteerPlace.objects.all().delete()
+            total, batch = 0, []
+            for row in csv.reader(dump, delimiter="\t", quoting=csv.QUOTE_NONE):
+                if row[FEATURE_CLASS] != "P" or (countries and row[COUNTRY] not in countries):
+                    continue
+                population = int(row[POPULATION] or 0)
+                if population < options['min_population']:
+                    continue
+
+                batch.append(GazetteerPlace(
+                    geoname_id=int(row[GEONAME_ID]),
+                    name=row[NAME],
+                    country=row[COUNTRY],
+                    location=Point(float(row[LONGITUDE]), float(row[LATITUDE]), srid=4326),
+                    population=population,
+                ))
+                if len(batch) == batch_size:
+                    GazetteerPlace.objects.bulk_create(batch)
+                    total, batch = total + len(batch), []
+
+            GazetteerPlace.objects.bulk_create(batch)
+            total += len(batch)
+
+        # running processes reload it within GAZETTEER_CHECK_INTERVAL
+        gazetteer.invalidate()
+        self.stdout.write(self.style.SUCCESS(f"Imported {total} places"))
+
+    def open_dump(self, path):
+        csv.field_size_limit(sys.maxsize)
+        try:
+            if path.endswith(".zip"):
+                archive = zipfile.ZipFile(path)
+                name = next(name for name in archive.namelist() if name.endswith(".txt") and name != "readme.txt")
+                return io.TextIOWrapper(archive.open(name), encoding="utf-8")
+            return open(path, encoding="utf-8", newline="")
+        except (OSError, zipfile.BadZipFile, StopIteration) as error:
+            raise CommandError(f"Cannot read {path}: {error}")
@@ -0,0 +1,102 @@
+import asyncio
+import base64
+import os
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Open websockets against a running server in growing steps and report how many it holds. "
+        "Run it against one Daphne worker before and after a consumer change to compare"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', default='ws://localhost:8000/ws/chat/',
+            help='Websocket endpoint (default: ws://localhost:8000/ws/chat/)'
+        )
+        parser.add_argument(
+            '--max', type=int, default=5000,
+            help='Stop after this many sockets (default: 5000)'
+        )
+        parser.add_argument(
+            '--step', type=int, default=250,
+            help='Sockets opened concurrently per step (default: 250)'
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=10,
+            help='Seconds a handshake may take before it counts as failed (default: 10)'
+        )
+        parser.add_argument(
+            '--hold', type=float, default=5,
+            help='Seconds to keep every socket open before checking it is still alive (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        # one token per socket, cycling through the users in the database
+        user_ids = list(User.objects.filter(is_active=True).values_list("id", flat=True)[:options['max']])
+        if not user_ids:
+            raise CommandError("No users to connect as, run manage.py seed first")
+
+        tokens = [str(AccessToken.for_user(User(id=user_id))) for user_id in user_ids]
+        asyncio.run(self.run(tokens, options))
+
+    async def run(self, tokens, options):
+        url = urlsplit(options['url'])
+        sockets = []
+
+        while len(sockets) < options['max']:
+            count = min(options['step'], options['max'] - len(sockets))
+            batch = [tokens[(len(sockets) + index) % len(tokens)] for index in range(count)]
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(self.connect(url, token, options['timeout']) for token in batch))
+            elapsed = time.perf_counter() - started
+
+            opened = [result for result in results if result is not None]
+            sockets.extend(connection for connection, _ in opened)
+            latencies = np.array([latency for _, latency in opened]) * 1000 if opened else np.zeros(1)
+            self.stdout.write(
+                f"{len(sockets)} open (+{len(opened)}/{count} in {elapsed:.2f}s) "
+                f"handshake p50={np.percentile(latencies, 50):.1f}ms p95={np.percentile(latencies, 95):.1f}ms"
+            )
+            if len(opened) < count:
+                break
+
+        await asyncio.sleep(options['hold'])
+        alive = sum(not writer.transport.is_closing() and not reader.at_eof() for writer, reader in sockets)
+        self.stdout.write(self.style.SUCCESS(f"Held {alive} of {len(sockets)} sockets for {options['hold']}s"))
+
+        for writer, _ in sockets:
+            writer.close()
+
+    async def connect(self, url, token, timeout):
+        """ a websocket handshake, ((writer, reader), seconds) when accepted else None """
+        started = time.perf_counter()
+        try:
+            reader, writer = await asyncio.wait_for(
+                asyncio.open_connection(url.hostname, url.port or (443 if url.scheme == "wss" else 80), ssl=url.scheme == "wss"), timeout
+            )
+            writer.write((
+                f"GET {url.path}?token={token} HTTP/1.1\r\n"
+                f"Host: {url.netloc}\r\n"
+                "Upgrade: websocket\r\n"
+                "Connection: Upgrade\r\n"
+                f"Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}\r\n"
+                "Sec-WebSocket-Version: 13\r\n\r\n"
+            ).encode())
+            response = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+            return None
+
+        if not response.startswith(b"HTTP/1.1 101"):
+            writer.close()
+            return None
+        return (writer, reader), time.perf_counter() - started
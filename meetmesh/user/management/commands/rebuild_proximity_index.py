@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from user.proximity import get_store, refresh_watchers
+
+
+class Command(BaseCommand):
+    help = "Rebucket every proximity watcher from the users' current locations and preferences"
+
+    def handle(self, *args, **options):
+        get_store().clear()
+        refresh_watchers()
+        self.stdout.write(self.style.SUCCESS("Rebuilt the proximity index"))
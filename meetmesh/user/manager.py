@@ -1,4 +1,8 @@
 from django.contrib.auth.models import BaseUserManager
+from django.contrib.gis.db.models.functions import Distance
+from django.contrib.gis.measure import D
+from django.db.models import Exists, OuterRef, Q
+from utilities.choices import WhoCanDiscover
 
 class CustomUserManager(BaseUserManager):
     def create_user(self, email, password=None, **extra_fields):
@@ -25,3 +29,39 @@ class CustomUserManager(BaseUserManager):
             raise ValueError("Superuser must have is_superuser=True.")
         
         return self.create_user(email, password, **extra_fields)
+
+    def nearby(self, location, radius_km, viewer=None):
+        """
+        Users whose base_location lies within radius_km of location, closest first.
+
+        ST_DWithin on the geography column is answered from the GiST index, so the
+        cost depends on how many users are around location, not on the table size.
+        Each user is annotated with `distance` (a Distance measure). With a viewer,
+        only users discoverable by them are returned.
+        """
+        queryset = self.discoverable_by(viewer) if viewer is not None else self.get_queryset()
+        return queryset.filter(
+            base_location__dwithin=(location, D(km=radius_km))
+        ).annotate(
+            distance=Distance("base_location", location)
+        ).order_by("distance", "id")
+
+    def discoverable_by(self, viewer):
+        """
+        Users whose who_can_discover_me and require_profile_completion preferences
+        let `viewer` see them.
+
+        Most users keep the defaults, so the restricted preferences are matched
+        with an anti-join on the partial index over the few restrictive rows
+        instead of joining every candidate's preference.
+        """
+        hidden = Q(who_can_discover_me=WhoCanDiscover.ONLY_ME)
+        if not viewer.is_verified:
+            hidden |= Q(who_can_discover_me=WhoCanDiscover.VERIFIED_USER)
+        if not viewer.has_completed_onboarding:
+            hidden |= Q(require_profile_completion=True)
+
+        preference_model = self.model._meta.get_field("user_preference").related_model
+        return self.get_queryset().filter(is_active=True).exclude(
+            Exists(preference_model.objects.filter(hidden, user=OuterRef("pk")))
+        )
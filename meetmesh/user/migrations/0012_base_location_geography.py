@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 07:27
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0011_remove_notification_uid_remove_user_uid_and_more'),
+    ]
+
+    operations = [
+        # Drop the geometry GiST index first; it is rebuilt as a geography
+        # index once the column type has changed.
+        migrations.AlterField(
+            model_name='user',
+            name='base_location',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, null=True, spatial_index=False, srid=4326),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='base_location',
+            field=django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 07:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0013_user_recommendation'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userpreference',
+            index=models.Index(condition=models.Q(('who_can_discover_me__in', ['VERIFIED_USER', 'ONLY_ME']), ('require_profile_completion', True), _connector='OR'), fields=['user'], name='preference_restricted_idx'),
+        ),
+    ]
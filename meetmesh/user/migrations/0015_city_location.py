@@ -0,0 +1,29 @@
+# Generated by Django 5.2 on 2026-10-18 07:42
+
+import django.contrib.gis.db.models.fields
+import utilities.utils
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0014_userpreference_restricted_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CityLocation',
+            fields=[
+                ('id', models.CharField(db_index=True, default=utilities.utils.generate_uuid, max_length=300, primary_key=True, serialize=False, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('name', models.CharField(max_length=300, unique=True)),
+                ('location', django.contrib.gis.db.models.fields.PointField(blank=True, geography=True, null=True, srid=4326)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2 on 2026-10-18 07:44
+
+import django.contrib.gis.db.models.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0015_city_location'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GazetteerPlace',
+            fields=[
+                ('geoname_id', models.PositiveIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=200)),
+                ('country', models.CharField(max_length=2)),
+                ('location', django.contrib.gis.db.models.fields.PointField(geography=True, srid=4326)),
+                ('population', models.BigIntegerField(default=0)),
+            ],
+        ),
+    ]
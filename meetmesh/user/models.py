@@ -1,6 +1,5 @@
 from django.contrib.gis.db import models
 from django.db.models import Q
-from django.core.cache import cache
 from django.contrib.auth.models import AbstractUser
 from django.core.mail import send_mail
 from django_countries.fields import CountryField
@@ -19,7 +18,7 @@ class User(BaseModelMixin, AbstractUser):
     username = models.CharField(max_length=50, unique=True, null=True, blank=True)
     city = models.CharField(max_length=60, null=True, blank=True)
     country = CountryField(blank=True, null=True, max_length=100)
-    base_location = models.PointField(blank=True, null=True)
+    base_location = models.PointField(geography=True, blank=True, null=True)
     current_location = models.PointField(blank=True, null=True) # would be the browser location to get user current location
     has_completed_onboarding = models.BooleanField(default=False)
 
@@ -48,14 +47,9 @@ class User(BaseModelMixin, AbstractUser):
         )
     
     @property
-    def channel_name(self):
-        key = f"user_channel_name.{self.id}"
-        return cache.get(key)
-
-    @channel_name.setter
-    def channel_name(self, value):
-        key = f"user_channel_name.{self.id}"
-        return cache.set(key, value, 60 * 60 * 24)
+    def group_name(self):
+        """ channel layer group of every socket the user has open """
+        return f"user_{self.id}"
 
     def email_user(self, subject, message, from_email=None, **kwargs):
         """Send an email to this user."""
@@ -106,6 +100,19 @@ class UserPreference(BaseModelMixin):
     notify_on_meetup_invites = models.BooleanField(default=False, null=True, blank=True)
     require_profile_completion = models.BooleanField(default=False, null=True, blank=True)
 
+    class Meta(BaseModelMixin.Meta):
+        indexes = [
+            # only the users who restrict discovery, see CustomUserManager.discoverable_by
+            models.Index(
+                fields=['user'],
+                name='preference_restricted_idx',
+                condition=(
+                    Q(who_can_discover_me__in=[choices.WhoCanDiscover.VERIFIED_USER, choices.WhoCanDiscover.ONLY_ME])
+                    | Q(require_profile_completion=True)
+                ),
+            ),
+        ]
+
 
 class Notification(BaseModelMixin):
     receiver = models.ForeignKey("User", on_delete=models.CASCADE, related_name='notification_receiver')
@@ -121,3 +128,31 @@ class Notification(BaseModelMixin):
     """
 
 
+class UserRecommendation(BaseModelMixin):
+    """ precomputed "people like you" list, rank 0 being the most similar user """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommendations')
+    recommended_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='recommended_to')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['rank']
+        unique_together = ('user', 'recommended_user')
+        indexes = [
+            models.Index(fields=['user', 'rank'], name='recommendation_user_rank_idx'),
+        ]
+
+
+class CityLocation(BaseModelMixin):
+    """ geocoder answers by normalized city name, location is null when the city was not found """
+    name = models.CharField(max_length=300, unique=True)
+    location = models.PointField(geography=True, blank=True, null=True)
+
+
+class GazetteerPlace(models.Model):
+    """ a populated place from a GeoNames dump, see manage.py import_gazetteer """
+    geoname_id = models.PositiveIntegerField(primary_key=True)
+    name = models.CharField(max_length=200)
+    country = models.CharField(max_length=2)
+    location = models.PointField(geography=True)
+    population = models.BigIntegerField(default=0)
@@ -0,0 +1,99 @@
+"""
+Online presence across devices and workers.
+
+Every open socket is a member of its user's Redis sorted set, scored by the
+time its last heartbeat expires. A user is online while any member is
+unexpired, so a second tab adds a member instead of overwriting one and a
+socket whose worker died simply stops being refreshed. Connects, heartbeats
+and disconnects also stamp the user's last_seen in a Redis hash, written to
+Profile in bulk by flush_last_seen.
+"""
+import logging
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__file__)
+
+PREFIX = "presence"
+LAST_SEEN_KEY = f"{PREFIX}:last_seen"
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    import redis
+    return redis.Redis.from_url(settings.PRESENCE_REDIS_URL, decode_responses=True)
+
+
+@lru_cache(maxsize=None)
+def get_async_redis():
+    import redis.asyncio
+    return redis.asyncio.Redis.from_url(settings.PRESENCE_REDIS_URL, decode_responses=True)
+
+
+def user_key(user_id):
+    return f"{PREFIX}:user:{user_id}"
+
+
+async def heartbeat(user_id, channel_name):
+    """ mark channel_name of user_id alive for PRESENCE_TTL seconds, also used on connect """
+    now = time.time()
+    key = user_key(user_id)
+    async with get_async_redis().pipeline(transaction=False) as pipeline:
+        pipeline.zadd(key, {channel_name: now + settings.PRESENCE_TTL})
+        pipeline.zremrangebyscore(key, "-inf", now)
+        pipeline.expire(key, settings.PRESENCE_TTL)
+        pipeline.hset(LAST_SEEN_KEY, user_id, now)
+        await pipeline.execute()
+
+
+async def disconnect(user_id, channel_name):
+    async with get_async_redis().pipeline(transaction=False) as pipeline:
+        pipeline.zrem(user_key(user_id), channel_name)
+        pipeline.hset(LAST_SEEN_KEY, user_id, time.time())
+        await pipeline.execute()
+
+
+def are_online(user_ids):
+    """ {user_id: bool} for all of user_ids in one round trip, everyone offline when Redis is unreachable """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return {}
+
+    now = time.time()
+    try:
+        with get_redis().pipeline(transaction=False) as pipeline:
+            for user_id in user_ids:
+                pipeline.zcount(user_key(user_id), now, "+inf")
+            counts = pipeline.execute()
+    except RedisError:
+        logger.exception("Could not read presence")
+        counts = [0] * len(user_ids)
+    return {user_id: count > 0 for user_id, count in zip(user_ids, counts)}
+
+
+def flush_last_seen(batch_size=1000):
+    """ write the pending last_seen stamps and the matching is_online flags to Profile """
+    from .models import Profile
+
+    redis = get_redis()
+    with redis.pipeline() as pipeline:
+        pipeline.hgetall(LAST_SEEN_KEY)
+        pipeline.delete(LAST_SEEN_KEY)
+        stamps, _ = pipeline.execute()
+
+    # sockets that vanished without a disconnect leave is_online set, recheck those too
+    stale = list(Profile.objects.filter(is_online=True).exclude(user_id__in=list(stamps)).values_list("user_id", flat=True))
+    online = are_online([*stamps, *stale])
+
+    stamped = [
+        Profile(user_id=user_id, is_online=online[user_id], last_seen=datetime.fromtimestamp(float(stamp), tz=timezone.utc))
+        for user_id, stamp in stamps.items()
+    ]
+    offline = [Profile(user_id=user_id, is_online=False) for user_id in stale if not online[user_id]]
+    Profile.objects.bulk_update(stamped, ["is_online", "last_seen"], batch_size=batch_size)
+    Profile.objects.bulk_update(offline, ["is_online"], batch_size=batch_size)
+    return len(stamped) + len(offline)
@@ -0,0 +1,228 @@
+"""
+Proximity alerts.
+
+Every user with notify_on_proximity is a watcher, kept in exactly one bucket:
+the cell holding their current_location at the finest level of the
+PROXIMITY_CELL_DEGREES grids whose cell height still covers their radius.
+Anyone within the radius is then in that cell or an adjacent one, so a
+moving user only reads the cells around them at each level, whatever the
+total number of users, and the few watchers found are checked exactly.
+"""
+import math
+from collections import defaultdict
+from functools import lru_cache
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from utilities.choices import NotificationType, WhoCanDiscover
+
+KM_PER_DEGREE = 111.195
+EARTH_RADIUS_KM = 6371.0088
+WORLD_CELL = "world"
+
+
+class MemoryCellStore:
+    """ buckets held by the current process, for tests and a single worker """
+
+    def __init__(self):
+        self.cells = defaultdict(set)
+        self.watchers = {}
+
+    def set_watcher(self, user_id, cell, record):
+        self.remove_watcher(user_id)
+        self.cells[cell].add(user_id)
+        self.watchers[user_id] = (cell, record)
+
+    def remove_watcher(self, user_id):
+        previous = self.watchers.pop(user_id, None)
+        if previous is not None:
+            self.cells[previous[0]].discard(user_id)
+
+    def watchers_in(self, cells):
+        """ {user_id: (longitude, latitude, radius_km)} of the watchers bucketed in cells """
+        user_ids = set().union(*(self.cells.get(cell, ()) for cell in cells))
+        return {user_id: self.watchers[user_id][1] for user_id in user_ids}
+
+    def clear(self):
+        self.cells.clear()
+        self.watchers.clear()
+
+
+class RedisCellStore:
+    """ buckets as Redis sets shared by every worker, records in one hash """
+    prefix = "proximity"
+
+    def __init__(self):
+        import redis
+        self.redis = redis.Redis.from_url(settings.PROXIMITY_REDIS_URL, decode_responses=True)
+        self.records_key = f"{self.prefix}:watchers"
+
+    def set_watcher(self, user_id, cell, record):
+        previous = self.redis.hget(self.records_key, user_id)
+        with self.redis.pipeline() as pipeline:
+            if previous is not None:
+                pipeline.srem(self._cell_key(previous.rsplit("|", 1)[1]), user_id)
+            pipeline.sadd(self._cell_key(cell), user_id)
+            pipeline.hset(self.records_key, user_id, "%r,%r,%r|%s" % (*record, cell))
+            pipeline.execute()
+
+    def remove_watcher(self, user_id):
+        previous = self.redis.hget(self.records_key, user_id)
+        if previous is not None:
+            with self.redis.pipeline() as pipeline:
+                pipeline.srem(self._cell_key(previous.rsplit("|", 1)[1]), user_id)
+                pipeline.hdel(self.records_key, user_id)
+                pipeline.execute()
+
+    def watchers_in(self, cells):
+        user_ids = list(self.redis.sunion([self._cell_key(cell) for cell in cells]))
+        if not user_ids:
+            return {}
+
+        records = self.redis.hmget(self.records_key, user_ids)
+        return {
+            user_id: tuple(float(value) for value in record.rsplit("|", 1)[0].split(","))
+            for user_id, record in zip(user_ids, records) if record is not None
+        }
+
+    def clear(self):
+        keys = list(self.redis.scan_iter(f"{self.prefix}:*"))
+        if keys:
+            self.redis.delete(*keys)
+
+    def _cell_key(self, cell):
+        return f"{self.prefix}:cell:{cell}"
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    return import_string(settings.PROXIMITY_STORE)()
+
+
+def watcher_cell(longitude, latitude, radius_km):
+    """ the bucket of a watcher, see the module docstring """
+    for level, size in enumerate(settings.PROXIMITY_CELL_DEGREES):
+        if size * KM_PER_DEGREE >= radius_km:
+            return _cell(level, *_cell_index(longitude, latitude, size))
+    return WORLD_CELL
+
+
+def neighbouring_cells(longitude, latitude):
+    """ the cells, at every level, that may hold a watcher whose radius covers (longitude, latitude) """
+    cells = [WORLD_CELL]
+    for level, size in enumerate(settings.PROXIMITY_CELL_DEGREES):
+        x, y = _cell_index(longitude, latitude, size)
+        columns = round(360 / size)
+        # cells narrow towards the poles, so more columns are within one cell height there
+        edge = min(abs(latitude) + size, 89.9)
+        x_span = min(math.ceil(1 / math.cos(math.radians(edge))), columns // 2)
+        rows = range(max(y - 1, math.floor(-90 / size)), min(y + 1, math.ceil(90 / size) - 1) + 1)
+        cells.extend(
+            _cell(level, column, row)
+            for row in rows
+            for column in {(x + offset) % columns for offset in range(-x_span, x_span + 1)}
+        )
+    return cells
+
+
+def watchers_covering(longitude, latitude, store=None):
+    """ ids of the watchers whose radius covers (longitude, latitude) """
+    watchers = (store or get_store()).watchers_in(neighbouring_cells(longitude, latitude))
+    if not watchers:
+        return []
+
+    user_ids = list(watchers)
+    records = np.array([watchers[user_id] for user_id in user_ids], dtype=np.float64)
+    distances = haversine_km(longitude, latitude, records[:, 0], records[:, 1])
+    return [user_id for user_id, covered in zip(user_ids, distances <= records[:, 2]) if covered]
+
+
+def haversine_km(longitude, latitude, longitudes, latitudes):
+    lng1, lat1, lng2, lat2 = map(np.radians, (longitude, latitude, longitudes, latitudes))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def refresh_watchers(user_ids=None, chunk_size=2000):
+    """ (re)bucket the given users, or every watcher, from their current_location and preferences """
+    from .models import User
+
+    store = get_store()
+    users = User.objects.order_by().values_list(
+        "id", "current_location", "is_active",
+        "user_preference__notify_on_proximity", "user_preference__notify_radius_km",
+    )
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    else:
+        # a full rebuild starts from an empty store, only watchers need adding
+        users = users.filter(current_location__isnull=False, is_active=True, user_preference__notify_on_proximity=True)
+
+    for user_id, location, is_active, notify, radius_km in users.iterator(chunk_size=chunk_size):
+        if location is None or not is_active or not notify or not radius_km:
+            store.remove_watcher(user_id)
+        else:
+            store.set_watcher(user_id, watcher_cell(location.x, location.y, radius_km), (location.x, location.y, radius_km))
+
+
+def alert_watchers(moves):
+    """
+    Notify the watchers whose radius covers a user who moved, at most once per
+    PROXIMITY_ALERT_COOLDOWN for a pair. `moves` is a list of
+    (user_id, longitude, latitude).
+    """
+    from .models import Notification, User
+
+    store = get_store()
+    refresh_watchers([user_id for user_id, _, _ in moves])
+
+    pairs = {
+        (watcher_id, mover_id)
+        for mover_id, longitude, latitude in moves
+        for watcher_id in watchers_covering(longitude, latitude, store)
+        if watcher_id != mover_id
+    }
+    if not pairs:
+        return []
+
+    # the mover's who_can_discover_me applies to alerts like it does to feeds
+    users = User.objects.filter(
+        id__in={user_id for pair in pairs for user_id in pair}, is_active=True
+    ).select_related("user_preference").in_bulk()
+
+    notifications = []
+    for watcher_id, mover_id in sorted(pairs):
+        watcher, mover = users.get(watcher_id), users.get(mover_id)
+        if watcher is None or mover is None or not _discoverable(mover, watcher):
+            continue
+        if not cache.add(f"proximity_alert.{watcher_id}.{mover_id}", 1, settings.PROXIMITY_ALERT_COOLDOWN):
+            continue
+
+        notifications.append(Notification(
+            receiver=watcher,
+            sender=mover,
+            type=NotificationType.PROXIMITY_ALERT,
+            metadata={"message": f"{mover.fullname} is near you"},
+        ))
+    return Notification.objects.bulk_create(notifications)
+
+
+def _discoverable(user, viewer):
+    preference = user.user_preference
+    if preference.who_can_discover_me == WhoCanDiscover.ONLY_ME:
+        return False
+    if preference.who_can_discover_me == WhoCanDiscover.VERIFIED_USER and not viewer.is_verified:
+        return False
+    return not (preference.require_profile_completion and not viewer.has_completed_onboarding)
+
+
+def _cell_index(longitude, latitude, size):
+    columns = round(360 / size)
+    return math.floor((longitude + 180) / size) % columns, math.floor(min(latitude, 89.999999) / size)
+
+
+def _cell(level, x, y):
+    return f"{level}:{x}:{y}"
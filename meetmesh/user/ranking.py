@@ -0,0 +1,107 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Func, IntegerField, Value
+from django.db.models.functions import Extract
+
+FeedCandidate = namedtuple("FeedCandidate", ["id", "score"])
+
+
+class InterestCount(Func):
+    """ length of a JSON list column, 0 when null """
+    template = "jsonb_array_length(COALESCE(%(expressions)s, '[]'::jsonb))"
+    output_field = IntegerField()
+
+
+class SharedInterests(Func):
+    """ how many entries of a JSON list column are in `interests` """
+    output_field = IntegerField()
+
+    def __init__(self, expression, interests):
+        super().__init__(expression, Value(sorted(interests)))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column, column_params = compiler.compile(self.source_expressions[0])
+        interests, interests_params = compiler.compile(self.source_expressions[1])
+        sql = (
+            f"(SELECT count(*) FROM jsonb_array_elements_text(COALESCE({column}, '[]'::jsonb)) AS interest "
+            f"WHERE btrim(interest) = ANY({interests}))"
+        )
+        return sql, (*column_params, *interests_params)
+
+
+def score_candidates(distances_km, shared_interests, interest_counts, user_interest_count,
+                     is_online, last_seen, weights=None, now=None):
+    """
+    Score feed candidates, higher is better, as a weighted sum of
+
+    - distance: exp(-distance / FEED_DISTANCE_DECAY_KM)
+    - interests: Jaccard overlap, shared / (candidate's + user's - shared)
+    - online: 1 when the candidate is online
+    - recency: exp(-hours since last_seen / FEED_RECENCY_DECAY_HOURS), 0 if never seen
+
+    Every argument but the user's interest count is an array with one entry per
+    candidate (last_seen in epoch seconds, NaN when unknown), and every term is
+    computed over the whole candidate set at once.
+    """
+    weights = {**settings.FEED_RANKING_WEIGHTS, **(weights or {})}
+    now = time.time() if now is None else now
+
+    proximity = np.exp(-np.asarray(distances_km, dtype=np.float64) / settings.FEED_DISTANCE_DECAY_KM)
+
+    shared_interests = np.asarray(shared_interests, dtype=np.float64)
+    union = np.asarray(interest_counts, dtype=np.float64) + user_interest_count - shared_interests
+    overlap = np.divide(shared_interests, union, out=np.zeros_like(union), where=union > 0)
+
+    hours_since_seen = (now - np.asarray(last_seen, dtype=np.float64)) / 3600
+    recency = np.nan_to_num(np.exp(-np.clip(hours_since_seen, 0, None) / settings.FEED_RECENCY_DECAY_HOURS))
+
+    return (
+        weights["distance"] * proximity
+        + weights["interests"] * overlap
+        + weights["online"] * np.asarray(is_online, dtype=np.float64)
+        + weights["recency"] * recency
+    )
+
+
+def rank_feed(user, candidates, weights=None):
+    """
+    Rank a feed candidate queryset (User.objects.nearby) for `user`, best first.
+    At most FEED_MAX_CANDIDATES of the closest candidates are considered; the
+    interest overlap is counted in SQL so only numbers come back per candidate.
+    """
+    user_interests = user_interest_set(user)
+    rows = candidate_rows(candidates, user_interests)
+    if not rows:
+        return []
+
+    ids, distances, shared_interests, interest_counts, is_online, last_seen = zip(*rows)
+    scores = score_candidates(
+        distances_km=np.fromiter((distance.km for distance in distances), dtype=np.float64, count=len(rows)),
+        shared_interests=shared_interests,
+        interest_counts=interest_counts,
+        user_interest_count=len(user_interests),
+        is_online=np.array(is_online, dtype=bool),
+        last_seen=np.array(last_seen, dtype=np.float64),
+        weights=weights,
+    )
+
+    order = np.lexsort((ids, -scores))
+    return [FeedCandidate(ids[index], float(scores[index])) for index in order]
+
+
+def user_interest_set(user):
+    return {interest.strip() for interest in user.profile.interests or [] if interest}
+
+
+def candidate_rows(candidates, user_interests):
+    """ (id, distance, shared_interests, interest_count, is_online, last_seen_epoch) of the closest candidates """
+    return list(candidates.annotate(
+        shared_interests=SharedInterests(F("profile__interests"), user_interests),
+        interest_count=InterestCount(F("profile__interests")),
+        last_seen_epoch=Extract(F("profile__last_seen"), "epoch"),
+    ).values_list(
+        "id", "distance", "shared_interests", "interest_count", "profile__is_online", "last_seen_epoch"
+    )[:settings.FEED_MAX_CANDIDATES])
@@ -1,71 +1,277 @@
-import pandas as pd
+import time
+from array import array
+from functools import lru_cache
+
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+from sklearn.preprocessing import normalize
+from django.conf import settings
+from django.db import transaction
 from django.contrib.auth import get_user_model
-from .models import Profile
+from .ann import RandomProjectionIndex
+from .models import Profile, UserRecommendation
 
 User = get_user_model()
 
+CHANGED_KEY = "recommendations:changed"
+
+# (vectors, user_ids, vocabulary, built at), see user_vectors
+_vectors = None
+# (vectors, n_tables, n_bits, index), see ann_index
+_ann_index = None
+
+
+def profile_features(interests, occupation, city):
+    """ the one-hot feature names of a profile, e.g. interest_music, occupation_doctor, city_lagos """
+    features = {f"interest_{interest.strip()}" for interest in interests or [] if interest and interest.strip()}
+    if occupation:
+        features.add(f"occupation_{occupation}")
+    if city:
+        features.add(f"city_{city}")
+    return features
+
+
+def generate_user_vectors(chunk_size=2000):
+    """
+    Build the user feature matrix as a binary CSR matrix, one row per profile.
+
+    Profiles are streamed as tuples and every feature gets a column the first time
+    it is seen, so memory is proportional to the number of non-zero entries rather
+    than users x vocabulary. Returns (vectors, user_ids, vocabulary).
+    """
+    rows = Profile.objects.order_by("user_id").values_list(
+        "user_id", "interests", "occupation", "user__city"
+    ).iterator(chunk_size=chunk_size)
+
+    vocabulary = {}
+    vectors, user_ids = _profile_rows(rows, vocabulary)
+    return vectors, user_ids, vocabulary
+
+
+def update_user_vectors(vectors, user_ids, vocabulary, changed_user_ids):
+    """
+    generate_user_vectors with only the rows of changed_user_ids reloaded: their
+    rows move to the end, and users without a profile any more are dropped.
+    """
+    changed_user_ids = set(changed_user_ids)
+    keep = [row for row, user_id in enumerate(user_ids) if user_id not in changed_user_ids]
 
+    vocabulary = dict(vocabulary)
+    changed, changed_ids = _profile_rows(
+        Profile.objects.filter(user_id__in=changed_user_ids).order_by("user_id").values_list(
+            "user_id", "interests", "occupation", "user__city"
+        ),
+        vocabulary,
+    )
+    kept = vectors[keep]
+    kept = sparse.csr_matrix((kept.data, kept.indices, kept.indptr), shape=(len(keep), len(vocabulary)))
 
-def generate_user_vectors():
-    all_profiles = Profile.objects.select_related('user')
+    vectors = sparse.vstack([kept, changed], format="csr")
+    return vectors, [user_ids[row] for row in keep] + changed_ids, vocabulary
 
-    data = []
+
+def user_vectors(changed_user_ids=()):
+    """
+    The user feature matrix of this process, rebuilt every RECOMMENDATION_VECTORS_TTL
+    seconds and otherwise only updated for changed_user_ids.
+    """
+    global _vectors
+    if _vectors is None or time.monotonic() - _vectors[3] > settings.RECOMMENDATION_VECTORS_TTL:
+        _vectors = (*generate_user_vectors(), time.monotonic())
+    elif changed_user_ids:
+        _vectors = (*update_user_vectors(*_vectors[:3], changed_user_ids), _vectors[3])
+    return _vectors[:3]
+
+
+def _profile_rows(rows, vocabulary):
+    """ CSR rows of (user_id, interests, occupation, city) profiles, adding new features to vocabulary """
     user_ids = []
+    # "q" is 64 bits on every platform, "l" is 32 bits on Windows
+    indices = array("q")
+    indptr = array("q", [0])
+
+    for user_id, interests, occupation, city in rows:
+        columns = sorted(
+            vocabulary.setdefault(feature, len(vocabulary))
+            for feature in sorted(profile_features(interests, occupation, city))
+        )
+        indices.extend(columns)
+        indptr.append(len(indices))
+        user_ids.append(user_id)
+
+    vectors = sparse.csr_matrix(
+        (np.ones(len(indices), dtype=np.float32), np.frombuffer(indices, dtype=np.int64), np.frombuffer(indptr, dtype=np.int64)),
+        shape=(len(user_ids), len(vocabulary)),
+    )
+    return vectors, user_ids
+
+
+def top_k_neighbours(vectors, top_n=5, block_size=None, rows=None):
+    """
+    Yield (row, neighbour_rows, scores) for every row of `vectors` (or only the
+    given rows), the neighbours being the top_n other rows by cosine similarity,
+    best first.
+
+    Similarities are computed block_size query rows at a time, so memory stays at
+    block_size x N instead of N x N. Ties are broken by row index, which makes the
+    result identical to a full argsort of the similarity matrix.
+    """
+    block_size = block_size or settings.RECOMMENDATION_BLOCK_SIZE
+    vectors = normalize(sparse.csr_matrix(vectors, dtype=np.float32))
+    total = vectors.shape[0]
+    rows = np.arange(total) if rows is None else np.asarray(rows, dtype=np.int_)
+    k = min(top_n, total - 1)
+    if k <= 0:
+        return
+
+    for start in range(0, len(rows), block_size):
+        block_rows = rows[start:start + block_size]
+        block = (vectors[block_rows] @ vectors.T).toarray()
+        # never recommend a user to themselves, whatever their own score is
+        block[np.arange(len(block_rows)), block_rows] = -np.inf
 
-    for profile in all_profiles:
-        user = profile.user
-        user_ids.append(user.id)
-        data.append({
-            'user_id': user.id,
-            'interests': profile.interests or [],
-            'occupation': profile.occupation,
-            'city': user.city,
-        })
+        # the k-th best score of each row; everything tied with it is a candidate
+        thresholds = np.partition(block, total - k, axis=1)[:, total - k]
 
-    df = pd.DataFrame(data)
+        for offset, scores in enumerate(block):
+            candidates = np.flatnonzero(scores >= thresholds[offset])
+            order = np.lexsort((candidates, -scores[candidates]))[:k]
+            yield block_rows[offset], candidates[order], scores[candidates[order]]
 
-    interests_df = df['interests'].explode().str.strip().dropna()
-    all_unique_interests = interests_df.unique()
 
-    for interest in all_unique_interests:
-        df[f'interest_{interest}'] = df['interests'].apply(lambda x: int(interest in x))
+def ann_top_k_neighbours(vectors, top_n=5, n_tables=None, n_bits=None, rows=None):
+    """
+    Same contract as top_k_neighbours, answered from a RandomProjectionIndex.
+    n_tables is the recall-vs-latency knob, see RECOMMENDATION_ANN_TABLES.
+    """
+    index = ann_index(vectors, n_tables, n_bits)
 
-    df = pd.get_dummies(df, columns=['occupation', 'city'], dummy_na=False)
+    for row in range(vectors.shape[0]) if rows is None else rows:
+        neighbours, scores = index.query(row, top_n)
+        yield row, neighbours, scores
 
-    df.drop(columns=['user_id', 'interests'], inplace=True)
 
-    return df.to_numpy(), user_ids
+def ann_index(vectors, n_tables=None, n_bits=None):
+    """
+    The RandomProjectionIndex of vectors, only fitted again when vectors is another
+    matrix (user_vectors returns the same one until a profile changes) or the
+    parameters changed.
+    """
+    global _ann_index
+    n_tables = n_tables or settings.RECOMMENDATION_ANN_TABLES
+    n_bits = n_bits or settings.RECOMMENDATION_ANN_BITS
 
+    if _ann_index is None or _ann_index[0] is not vectors or _ann_index[1:3] != (n_tables, n_bits):
+        _ann_index = (vectors, n_tables, n_bits, RandomProjectionIndex(n_tables=n_tables, n_bits=n_bits).fit(vectors))
+    return _ann_index[3]
 
-def calculate_similarity(vectors):
-    similarity_matrix = cosine_similarity(vectors)
-    return similarity_matrix
 
+def neighbours_by_row(vectors, top_n=5, rows=None, block_size=None, backend=None):
+    if (backend or settings.RECOMMENDATION_BACKEND) == "ann":
+        return ann_top_k_neighbours(vectors, top_n, rows=rows)
+    return top_k_neighbours(vectors, top_n, block_size, rows=rows)
 
-def recommend_top_n_users(similarity_matrix, user_ids, top_n=5):
+
+def recommend_top_n_users(vectors, user_ids, top_n=5, block_size=None, backend=None):
     recommendations = {}
 
-    for i, user_id in enumerate(user_ids):
+    for row, neighbours, _ in neighbours_by_row(vectors, top_n, block_size=block_size, backend=backend):
+        recommendations[user_ids[row]] = [user_ids[idx] for idx in neighbours]
+
+    return recommendations
+
+
+def get_user_recommendations(top_n=5, backend=None):
 
-        similarity_scores = similarity_matrix[i]
+    vectors, user_ids, _ = generate_user_vectors()
 
-        similar_users_indices = similarity_scores.argsort()[-(top_n + 1):-1]
-        
-        similar_user_ids = [user_ids[idx] for idx in similar_users_indices]
-        
-        recommendations[user_id] = similar_user_ids
+    recommendations = recommend_top_n_users(vectors, user_ids, top_n, backend=backend)
 
     return recommendations
 
 
-def get_user_recommendations(top_n=5):
+def store_recommendations(neighbours, user_ids, replace=None, batch_size=5000):
+    """
+    Write (row, neighbour_rows, scores) results to UserRecommendation, replacing
+    the stored rows of `replace` (a queryset of users, None for every user).
+    """
+    stored = UserRecommendation.objects.all()
+    if replace is not None:
+        stored = stored.filter(user__in=replace)
 
-    vectors, user_ids = generate_user_vectors()
+    with transaction.atomic():
+        stored.delete()
 
-    similarity_matrix = calculate_similarity(vectors)
+        batch = []
+        for row, neighbour_rows, scores in neighbours:
+            for rank, (neighbour, score) in enumerate(zip(neighbour_rows, scores)):
+                batch.append(UserRecommendation(
+                    user_id=user_ids[row], recommended_user_id=user_ids[neighbour], score=float(score), rank=rank
+                ))
+            if len(batch) >= batch_size:
+                UserRecommendation.objects.bulk_create(batch)
+                batch = []
+        UserRecommendation.objects.bulk_create(batch)
 
-    recommendations = recommend_top_n_users(similarity_matrix, user_ids, top_n)
 
-    return recommendations
+def refresh_all_recommendations(top_n=None):
+    """ recompute and store every user's recommendations """
+    top_n = top_n or settings.RECOMMENDATION_TOP_N
+    vectors, user_ids, _ = generate_user_vectors()
+    store_recommendations(neighbours_by_row(vectors, top_n), user_ids)
+
+
+def refresh_user_recommendations(changed_user_ids, top_n=None):
+    """
+    Recompute only the recommendations a profile change can affect: the changed
+    users themselves, the users they are now similar to, and the users who
+    recommended them before the change.
+    """
+    top_n = top_n or settings.RECOMMENDATION_TOP_N
+    vectors, user_ids, _ = user_vectors(changed_user_ids)
+    row_of = {user_id: row for row, user_id in enumerate(user_ids)}
+
+    changed_rows = [row_of[user_id] for user_id in changed_user_ids if user_id in row_of]
+    affected = set(changed_rows)
+    for _, neighbour_rows, _ in neighbours_by_row(vectors, top_n, rows=changed_rows):
+        affected.update(int(row) for row in neighbour_rows)
+
+    previous = UserRecommendation.objects.filter(
+        recommended_user__in=changed_user_ids
+    ).values_list("user_id", flat=True)
+    affected.update(row_of[user_id] for user_id in previous if user_id in row_of)
+
+    affected = sorted(affected)
+    store_recommendations(
+        neighbours_by_row(vectors, top_n, rows=affected),
+        user_ids,
+        replace=[user_ids[row] for row in affected],
+    )
+
+
+@lru_cache(maxsize=None)
+def get_redis():
+    import redis
+    return redis.Redis.from_url(settings.RECOMMENDATION_REDIS_URL, decode_responses=True)
+
+
+def mark_changed(user_ids):
+    """ queue user_ids for the next refresh_changed_recommendations """
+    get_redis().sadd(CHANGED_KEY, *user_ids)
+
+
+def refresh_changed_recommendations():
+    """ refresh_user_recommendations for every user marked changed since the last run, in one go """
+    with get_redis().pipeline() as pipeline:
+        pipeline.smembers(CHANGED_KEY)
+        pipeline.delete(CHANGED_KEY)
+        changed, _ = pipeline.execute()
+    if not changed:
+        return
+
+    try:
+        refresh_user_recommendations(sorted(changed))
+    except Exception:
+        # picked up again by the next run
+        mark_changed(changed)
+        raise
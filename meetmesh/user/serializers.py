@@ -7,11 +7,12 @@ from django.contrib.auth.hashers import check_password
 from django.contrib.auth.tokens import PasswordResetTokenGenerator
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer as SimpleJWTTokenObtainPairSerializer
 from .models import Profile, User, UserPreference
+from . import geocoding
+from .tasks import geocode_user_location
 from utilities import choices
 from django_countries.fields import Country
 from django_countries.serializer_fields import CountryField
-from geopy.geocoders import Nominatim
-from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.contrib.gis.geos import Point
 
 
@@ -44,6 +45,7 @@ class UserSerializer:
         social_links = serializers.SerializerMethodField()
         location = serializers.SerializerMethodField()
         country = serializers.SerializerMethodField()
+        distance_km = serializers.SerializerMethodField()
 
         class Meta:
             model = User
@@ -54,6 +56,7 @@ class UserSerializer:
                 "city",
                 "country",
                 "location",
+                "distance_km",
                 "occupation",
                 "bio",
                 "interests",
@@ -76,6 +79,10 @@ class UserSerializer:
             return obj.profile.profile_image.url if hasattr(obj, "profile") else None
 
         def get_is_online(self, obj):
+            # views pass the page's presence.are_online() to avoid a lookup per row
+            online = self.context.get("online")
+            if online is not None:
+                return online.get(obj.id, False)
             return obj.profile.is_online if hasattr(obj, "profile") else False
 
         def get_social_links(self, obj):
@@ -89,6 +96,10 @@ class UserSerializer:
                 }
             return None
 
+        def get_distance_km(self, obj):
+            distance = getattr(obj, "distance", None)
+            return round(distance.km, 2) if distance is not None else None
+
         def get_country(self, obj):
             return {
                 # "code": obj.country.code,
@@ -119,16 +130,12 @@ class UserSerializer:
             user.last_name = validated_data.get("last_name")
 
             if city:
-                try:
-                    geolocator = Nominatim(user_agent="meetmesh_app")
-                    location = geolocator.geocode(city)
-                        
-                    if location:
-                        user.base_location = Point(location.longitude, location.latitude)
-                    else:
-                        raise ValidationError(f"Could not find coordinates for city: {city}")
-                except Exception as e:
-                    logger.error(f"Could not geocode {city}", e)
+                # known cities are placed right away, the others once geocode_user_location is done
+                place = geocoding.lookup(city, country)
+                if place is None:
+                    transaction.on_commit(lambda: geocode_user_location.delay(user.id, city, country))
+                elif place.location is not None:
+                    user.base_location = place.location
 
             user.save()
 
@@ -1,6 +1,24 @@
-from django.db.models.signals import post_save
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.dispatch import receiver
+from redis.exceptions import RedisError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
 from .models import User, Profile, UserPreference
+from . import auth_cache, feed_cache
+
+logger = logging.getLogger(__file__)
+
+# fields whose previous value post_save handlers need, see track_changed_fields
+TRACKED_FIELDS = {
+    Profile: ("interests", "occupation"),
+    User: ("city", "base_location", "current_location", "is_active"),
+    UserPreference: ("notify_on_proximity", "notify_radius_km"),
+}
+
+# the inputs of user/recommendation.py, a change to any of them refreshes recommendations
+RECOMMENDATION_FIELDS = {"interests", "occupation", "city"}
 
 
 @receiver(post_save, sender=User)
@@ -14,3 +32,112 @@ def create_user_related_models(sender, instance, created, **kwargs):
             user=instance,
             notify_radius_km=500
         )
+
+
+@receiver(pre_save, sender=UserPreference)
+@receiver(pre_save, sender=Profile)
+@receiver(pre_save, sender=User)
+def track_changed_fields(sender, instance, update_fields=None, **kwargs):
+    """ store {field: previous value} of the tracked fields that are about to change """
+    fields = TRACKED_FIELDS[sender]
+    instance._changed_fields = {}
+
+    if instance._state.adding or (update_fields and not set(update_fields) & set(fields)):
+        return
+
+    previous = sender.objects.filter(pk=instance.pk).values(*fields).first() or {}
+    instance._changed_fields = {
+        field: previous.get(field) for field in fields if previous.get(field) != getattr(instance, field)
+    }
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=User)
+def refresh_recommendations_on_change(sender, instance, **kwargs):
+    """ coalesced, see refresh_changed_recommendations """
+    if RECOMMENDATION_FIELDS & set(getattr(instance, "_changed_fields", {})):
+        user_id = instance.pk
+        transaction.on_commit(lambda: mark_recommendations_changed(user_id))
+
+
+@receiver(post_delete, sender=User)
+def refresh_recommendations_on_delete(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: mark_recommendations_changed(user_id))
+
+
+def mark_recommendations_changed(user_id):
+    from .recommendation import mark_changed
+    from .tasks import refresh_user_recommendations
+
+    try:
+        mark_changed([user_id])
+    except RedisError:
+        logger.exception(f"Could not queue the recommendations of {user_id}, refreshing them now")
+        refresh_user_recommendations.delay([user_id])
+
+
+@receiver(post_save, sender=User)
+def invalidate_feeds_on_move(sender, instance, **kwargs):
+    """ moving or (de)activating a user changes the feeds around them """
+    changed = getattr(instance, "_changed_fields", {})
+
+    if "base_location" in changed or "is_active" in changed:
+        previous, current = changed.get("base_location", instance.base_location), instance.base_location
+        transaction.on_commit(lambda: (feed_cache.invalidate_location(previous), feed_cache.invalidate_location(current)))
+
+
+@receiver(post_delete, sender=User)
+def invalidate_feeds_on_delete(sender, instance, **kwargs):
+    location = instance.base_location
+    transaction.on_commit(lambda: feed_cache.invalidate_location(location))
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_save, sender=UserPreference)
+def invalidate_feeds_on_profile_change(sender, instance, **kwargs):
+    """ the feed shows profiles and honours preferences, so either changing drops nearby feeds """
+    location = instance.user.base_location
+    transaction.on_commit(lambda: feed_cache.invalidate_location(location))
+
+    if sender is UserPreference:
+        user_id = instance.user_id
+        transaction.on_commit(lambda: feed_cache.invalidate_preferences(user_id))
+
+
+@receiver(post_save, sender=User)
+def alert_on_move(sender, instance, **kwargs):
+    from .tasks import proximity_alerts, refresh_proximity_watchers
+
+    changed = getattr(instance, "_changed_fields", {})
+    user_id, location = instance.pk, instance.current_location
+
+    if "current_location" in changed and location is not None:
+        move = (user_id, location.x, location.y)
+        transaction.on_commit(lambda: proximity_alerts.delay([move]))
+    elif "current_location" in changed or "is_active" in changed:
+        transaction.on_commit(lambda: refresh_proximity_watchers.delay([user_id]))
+
+
+@receiver(post_save, sender=UserPreference)
+def refresh_watcher_on_preference_change(sender, instance, **kwargs):
+    from .tasks import refresh_proximity_watchers
+
+    if getattr(instance, "_changed_fields", {}):
+        user_id = instance.user_id
+        transaction.on_commit(lambda: refresh_proximity_watchers.delay([user_id]))
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_save, sender=User)
+def invalidate_websocket_auth(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: auth_cache.invalidate_user(user_id))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def invalidate_blacklisted_token(sender, instance, created, **kwargs):
+    """ reload the user's revocation time, see user/auth_cache.py """
+    if created:
+        user_id = instance.token.user_id
+        transaction.on_commit(lambda: auth_cache.invalidate_user(user_id))
@@ -0,0 +1,46 @@
+from celery import shared_task
+from geopy.exc import GeocoderServiceError
+
+from . import geocoding, presence, proximity, recommendation
+from .models import User
+
+
+@shared_task
+def refresh_recommendations():
+    recommendation.refresh_all_recommendations()
+
+
+@shared_task
+def refresh_user_recommendations(user_ids):
+    recommendation.refresh_user_recommendations(user_ids)
+
+
+@shared_task
+def refresh_changed_recommendations():
+    recommendation.refresh_changed_recommendations()
+
+
+@shared_task(autoretry_for=(GeocoderServiceError,), retry_backoff=True, max_retries=5)
+def geocode_user_location(user_id, city, country=None):
+    place = geocoding.geocode(city, country)
+    user = User.objects.filter(pk=user_id, city=city).first()
+
+    # skip users who changed city since the task was queued, their own task follows
+    if user is not None and place.location is not None and user.base_location != place.location:
+        user.base_location = place.location
+        user.save(update_fields=["base_location", "updated_at"])
+
+
+@shared_task
+def proximity_alerts(moves):
+    proximity.alert_watchers(moves)
+
+
+@shared_task
+def refresh_proximity_watchers(user_ids):
+    proximity.refresh_watchers(user_ids)
+
+
+@shared_task
+def flush_last_seen():
+    presence.flush_last_seen()
@@ -0,0 +1,699 @@
+import tempfile
+from importlib.util import find_spec
+from datetime import datetime, timezone
+from itertools import count
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+
+import jwt
+from channels.testing import WebsocketCommunicator
+import numpy as np
+from redis.exceptions import ConnectionError as RedisConnectionError
+from scipy import sparse
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from rest_framework.exceptions import NotFound
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core import message_queue
+from core.models import Conversation, ConversationSummary
+from meetmesh.channel_auth_middleware import JWTAuthMiddleware
+from utilities.choices import WhoCanDiscover
+from utilities.pagination import FeedPagination
+
+from . import auth_cache, feed_cache, gazetteer, geocoding, presence, recommendation
+from .ann import RandomProjectionIndex
+from .consumer import ChatConsumer
+from .gazetteer import Gazetteer, GazetteerMatch
+from .models import CityLocation, GazetteerPlace, User, UserPreference, UserRecommendation
+from .ranking import FeedCandidate
+from .tasks import geocode_user_location
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FeedPaginationTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        self.user = SimpleNamespace(pk="viewer", id="viewer", is_verified=True, has_completed_onboarding=True)
+        self.rankings = count()
+        self.snapshots = {}
+
+    def rank(self):
+        """ every call scores differently, like a ranking recomputed a moment later """
+        offset = next(self.rankings)
+        key = f"ranking-{offset}"
+        self.snapshots[key] = [FeedCandidate(f"user-{(index + offset * 7) % 50}", 50.0 - index) for index in range(50)]
+        return key, self.snapshots[key]
+
+    def get_page(self, url, rank=None, load=None):
+        request = Request(self.factory.get(url))
+        request.user = self.user
+        paginator = FeedPagination()
+        page = paginator.paginate_ranking(rank or self.rank, load or self.snapshots.get, request)
+        return page, paginator.get_next_link(), paginator.get_previous_link()
+
+    def test_scroll_sees_every_candidate_once(self):
+        seen, url = [], "/users/feeds/?limit=8"
+        while url:
+            page, url, _ = self.get_page(url)
+            seen.extend(candidate.id for candidate in page)
+
+        # ranked for the first page only, the scroll is that first ranking
+        self.assertEqual(next(self.rankings), 1)
+        self.assertEqual(seen, [f"user-{index}" for index in range(50)])
+
+    def test_previous_link_returns_to_the_same_page(self):
+        first, next_url, previous_url = self.get_page("/users/feeds/?limit=10")
+        self.assertIsNone(previous_url)
+
+        second, _, previous_url = self.get_page(next_url)
+        self.assertEqual(self.get_page(previous_url)[0], first)
+        self.assertNotEqual(second, first)
+
+    def test_snapshot_of_another_user_is_rejected(self):
+        _, next_url, _ = self.get_page("/users/feeds/?limit=10")
+        self.user = SimpleNamespace(pk="someone-else")
+
+        with self.assertRaises(NotFound):
+            self.get_page(next_url)
+
+    def test_expired_snapshot_is_rejected(self):
+        _, next_url, _ = self.get_page("/users/feeds/?limit=10")
+        self.snapshots.clear()
+
+        with self.assertRaises(NotFound):
+            self.get_page(next_url)
+
+    @override_settings(CACHES=LOCMEM_CACHE)
+    def test_scroll_pages_through_the_cached_feed(self):
+        location = Point(3.39, 6.45, srid=4326)
+        rank = lambda: feed_cache.get_ranked_feed_snapshot(self.user, location, 10, candidates=None)
+
+        with mock.patch.object(feed_cache, "rank_feed", side_effect=lambda user, candidates: self.rank()[1]):
+            first, next_url, _ = self.get_page("/users/feeds/?limit=10", rank, feed_cache.load_ranked_feed)
+            # someone nearby moved, new feeds are ranked again but this scroll goes on
+            feed_cache.invalidate_location(location)
+            second, _, _ = self.get_page(next_url, rank, feed_cache.load_ranked_feed)
+
+        self.assertEqual(next(self.rankings), 1)
+        self.assertEqual(first + second, self.snapshots["ranking-0"][:20])
+
+
+class GazetteerTest(SimpleTestCase):
+    def setUp(self):
+        self.gazetteer = Gazetteer([
+            GazetteerMatch("Lagos", "NG", 3.39, 6.45, 9000000),
+            GazetteerMatch("Lagos", "PT", -8.67, 37.1, 30000),
+            GazetteerMatch("São Paulo", "BR", -46.63, -23.55, 12000000),
+            GazetteerMatch("Lafia", "NG", 8.52, 8.49, 300000),
+        ])
+
+    def test_resolve_prefers_the_most_populous_place(self):
+        self.assertEqual(self.gazetteer.resolve("lagos").country, "NG")
+        self.assertEqual(self.gazetteer.resolve("Lagos", "Portugal").country, "PT")
+        self.assertIsNone(self.gazetteer.resolve("Lagos", "FR"))
+
+    def test_resolve_ignores_case_accents_and_typos(self):
+        self.assertEqual(self.gazetteer.resolve("  sao   PAULO").name, "São Paulo")
+        self.assertEqual(self.gazetteer.resolve("Sao Paolo").name, "São Paulo")
+        self.assertIsNone(self.gazetteer.resolve("Sao Paolo", fuzzy=False))
+
+    def test_search_by_prefix(self):
+        self.assertEqual([place.country for place in self.gazetteer.search("la")], ["NG", "NG", "PT"])
+        self.assertEqual([place.name for place in self.gazetteer.search("la", "NG", limit=1)], ["Lagos"])
+        self.assertEqual(self.gazetteer.search(""), [])
+
+
+@override_settings(CACHES=LOCMEM_CACHE, GAZETTEER_CHECK_INTERVAL=0)
+class GazetteerImportTest(TestCase):
+    def import_dump(self, *places):
+        """ a GeoNames dump of (geoname_id, name, longitude, latitude, country, population) rows """
+        with tempfile.NamedTemporaryFile("w", suffix=".txt", encoding="utf-8") as dump:
+            for geoname_id, name, longitude, latitude, country, population in places:
+                row = [""] * 19
+                row[0], row[1], row[4], row[5], row[6], row[8], row[14] = (
+                    str(geoname_id), name, str(latitude), str(longitude), "P", country, str(population)
+                )
+                dump.write("\t".join(row) + "\n")
+            dump.flush()
+            call_command("import_gazetteer", dump.name, stdout=tempfile.TemporaryFile("w"))
+
+    def test_import_replaces_the_loaded_gazetteer(self):
+        self.import_dump((1, "Lagos", 3.39, 6.45, "NG", 9000000))
+        self.assertEqual(gazetteer.resolve("Lagos").coords, (3.39, 6.45))
+
+        self.import_dump((2, "Abuja", 7.49, 9.06, "NG", 3000000))
+        self.assertIsNone(gazetteer.resolve("Lagos"))
+        self.assertEqual(gazetteer.resolve("Abuja", "NG").coords, (7.49, 9.06))
+
+    def test_other_processes_reload_after_an_import(self):
+        GazetteerPlace.objects.create(geoname_id=1, name="Lagos", country="NG", location=Point(3.39, 6.45), population=1)
+        gazetteer.invalidate()
+        self.assertIsNotNone(gazetteer.resolve("Lagos"))
+
+        # what an import in another process leaves behind: a new table and a new version
+        GazetteerPlace.objects.all().delete()
+        cache.incr(gazetteer.VERSION_KEY)
+        self.assertIsNone(gazetteer.resolve("Lagos"))
+
+
+STATIC_GEOCODER = dict(
+    GEOCODER_BACKEND="user.geocoding.StaticGeocoder",
+    GEOCODER_STATIC_LOCATIONS={"Ibadan": (3.9, 7.38)},
+)
+
+
+@override_settings(**STATIC_GEOCODER)
+class GeocoderBackendTest(SimpleTestCase):
+    def test_backend_comes_from_settings(self):
+        geocoder = geocoding.get_geocoder()
+
+        self.assertIsInstance(geocoder, geocoding.StaticGeocoder)
+        self.assertEqual(geocoder.geocode("  ibadan ").coords, (3.9, 7.38))
+        self.assertIsNone(geocoder.geocode("Atlantis"))
+
+
+@override_settings(CACHES=LOCMEM_CACHE, **STATIC_GEOCODER)
+class GeocodeUserLocationTest(TestCase):
+    def setUp(self):
+        gazetteer.invalidate()
+        geocoding._recent.clear()
+        self.user = User.objects.create_user(
+            email="traveller@meetmesh.test", username="traveller", password="password", city="Ibadan"
+        )
+
+    def test_task_places_user_with_the_configured_backend(self):
+        geocode_user_location(self.user.id, "Ibadan", "Nigeria")
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.base_location.coords, (3.9, 7.38))
+        self.assertTrue(CityLocation.objects.filter(name="ibadan").exists())
+
+    def test_known_city_is_not_geocoded_again(self):
+        geocode_user_location(self.user.id, "Ibadan", "Nigeria")
+
+        with mock.patch.object(geocoding.StaticGeocoder, "geocode") as geocode:
+            self.assertEqual(geocoding.geocode("IBADAN").location.coords, (3.9, 7.38))
+        geocode.assert_not_called()
+
+    def test_unknown_city_is_stored_without_location(self):
+        self.user.city = "Atlantis"
+        self.user.save()
+        geocode_user_location(self.user.id, "Atlantis")
+
+        self.user.refresh_from_db()
+        self.assertIsNone(self.user.base_location)
+        self.assertIsNone(CityLocation.objects.get(name="atlantis").location)
+
+
+class ProfileRowsTest(SimpleTestCase):
+    def test_one_binary_row_per_profile(self):
+        vocabulary = {}
+        vectors, user_ids = recommendation._profile_rows([
+            ("u1", ["music", " music ", ""], "doctor", "Lagos"),
+            ("u2", None, None, None),
+            ("u3", ["music", "chess"], "doctor", None),
+        ], vocabulary)
+
+        self.assertEqual(user_ids, ["u1", "u2", "u3"])
+        self.assertEqual(vectors.shape, (3, len(vocabulary)))
+        rows = [{feature for feature, column in vocabulary.items() if vectors[row, column]} for row in range(3)]
+        self.assertEqual(rows, [
+            {"interest_music", "occupation_doctor", "city_Lagos"},
+            set(),
+            {"interest_music", "interest_chess", "occupation_doctor"},
+        ])
+
+
+class TopKNeighboursTest(SimpleTestCase):
+    def setUp(self):
+        vectors = sparse.random(60, 25, density=0.15, format="csr", random_state=np.random.default_rng(0))
+        vectors.data[:] = 1
+        # identical and empty profiles, so there are ties and zero scores
+        self.vectors = sparse.vstack([vectors, vectors[:5], sparse.csr_matrix((3, 25))], format="csr")
+
+    def brute_force(self, top_n):
+        """ every row's top_n scores from the dense cosine similarity matrix, in float64 """
+        dense = self.vectors.toarray().astype(np.float64)
+        norms = np.linalg.norm(dense, axis=1)
+        dense = np.divide(dense, norms[:, None], out=np.zeros_like(dense), where=norms[:, None] > 0)
+        similarity = dense @ dense.T
+        np.fill_diagonal(similarity, -np.inf)
+        return similarity, -np.sort(-similarity, axis=1)[:, :top_n]
+
+    def test_matches_brute_force(self):
+        top_n = 5
+        similarity, expected = self.brute_force(top_n)
+
+        for block_size in (1, 7, 1000):
+            results = list(recommendation.neighbours_by_row(self.vectors, top_n, block_size=block_size, backend="exact"))
+            self.assertEqual([row for row, _, _ in results], list(range(self.vectors.shape[0])))
+
+            for row, neighbours, scores in results:
+                self.assertNotIn(row, neighbours)
+                self.assertEqual(len(set(neighbours)), top_n)
+                # float32 and float64 may order tied neighbours differently, so compare scores
+                np.testing.assert_allclose(scores, expected[row], atol=1e-5)
+                np.testing.assert_allclose(similarity[row, neighbours], scores, atol=1e-5)
+
+    def test_only_requested_rows(self):
+        rows = [3, 61, 64]
+        results = list(recommendation.top_k_neighbours(self.vectors, 4, block_size=2, rows=rows))
+
+        self.assertEqual([row for row, _, _ in results], rows)
+
+
+def clustered_vectors(rows=240, clusters=8, columns=60, seed=0):
+    """ binary profiles drawn around a few prototypes, the kind of data LSH is meant for """
+    rng = np.random.default_rng(seed)
+    prototypes = rng.random((clusters, columns)) < 0.2
+    members = prototypes[rng.integers(clusters, size=rows)]
+    # flip a few features of every member
+    members ^= rng.random((rows, columns)) < 0.03
+    return sparse.csr_matrix(members.astype(np.float32))
+
+
+class RandomProjectionIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.vectors = clustered_vectors()
+        self.index = RandomProjectionIndex(n_tables=16, n_bits=8).fit(self.vectors)
+        self.exact = {row: scores for row, _, scores in recommendation.top_k_neighbours(self.vectors, 5)}
+
+    def test_query_scores_are_exact_cosine_similarities(self):
+        dense = self.vectors.toarray()
+        dense /= np.linalg.norm(dense, axis=1)[:, None]
+
+        for row in range(0, self.vectors.shape[0], 17):
+            neighbours, scores = self.index.query(row, 5)
+            self.assertNotIn(row, neighbours)
+            self.assertTrue(np.all(np.diff(scores) <= 0))
+            np.testing.assert_allclose(dense[neighbours] @ dense[row], scores, atol=1e-5)
+
+    def test_recall_against_exact_search(self):
+        found = total = 0
+        for row, scores in self.exact.items():
+            _, approximate = self.index.query(row, 5)
+            # a neighbour counts when it scores as well as the exact k-th, whichever of the tied rows it is
+            found += np.count_nonzero(approximate >= scores[-1] - 1e-5)
+            total += len(scores)
+
+        self.assertGreaterEqual(found / total, 0.9)
+
+    def test_query_vector_finds_the_indexed_row(self):
+        neighbours, scores = self.index.query_vector(self.vectors[10], 3)
+
+        self.assertIn(10, neighbours)
+        self.assertAlmostEqual(float(scores[0]), 1.0, places=5)
+
+    def test_n_bits_is_bounded(self):
+        with self.assertRaises(ValueError):
+            RandomProjectionIndex(n_bits=63)
+
+
+class AnnNeighboursTest(SimpleTestCase):
+    def setUp(self):
+        recommendation._ann_index = None
+        self.vectors = clustered_vectors(seed=1)
+
+    def test_same_contract_as_exact_search(self):
+        exact = list(recommendation.neighbours_by_row(self.vectors, 5, backend="exact"))
+        approximate = list(recommendation.neighbours_by_row(self.vectors, 5, backend="ann"))
+
+        self.assertEqual([row for row, _, _ in approximate], [row for row, _, _ in exact])
+        found = sum(
+            np.count_nonzero(scores >= expected[-1] - 1e-5)
+            for (_, _, expected), (_, _, scores) in zip(exact, approximate)
+        )
+        self.assertGreaterEqual(found / (5 * len(exact)), 0.9)
+
+        rows = [4, 9]
+        self.assertEqual([row for row, _, _ in recommendation.ann_top_k_neighbours(self.vectors, rows=rows)], rows)
+
+    def test_index_is_fitted_once_per_matrix(self):
+        with mock.patch.object(RandomProjectionIndex, "fit", autospec=True, side_effect=RandomProjectionIndex.fit) as fit:
+            list(recommendation.ann_top_k_neighbours(self.vectors, rows=[1]))
+            list(recommendation.ann_top_k_neighbours(self.vectors, rows=[2, 3]))
+            self.assertEqual(fit.call_count, 1)
+
+            list(recommendation.ann_top_k_neighbours(self.vectors[:100], rows=[1]))
+            list(recommendation.ann_top_k_neighbours(self.vectors[:100], n_tables=4, rows=[1]))
+            self.assertEqual(fit.call_count, 3)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class AuthCacheTest(SimpleTestCase):
+    LOGOUT = datetime(2026, 1, 1, 12, 0, 0, 500000, tzinfo=timezone.utc)
+
+    def setUp(self):
+        cache.clear()
+        auth_cache._recent.clear()
+        self.user = SimpleNamespace(pk="user-1", id="user-1")
+        self.load_user = mock.patch.object(auth_cache, "_load_user", return_value=(self.user, self.LOGOUT)).start()
+        self.addCleanup(mock.patch.stopall)
+
+    async def test_tokens_issued_before_the_latest_logout_are_revoked(self):
+        logout = int(self.LOGOUT.timestamp())
+
+        self.assertIsNone(await auth_cache.get_user("user-1", logout - 1))
+        self.assertIsNone(await auth_cache.get_user("user-1", None))
+        # iat has whole seconds, a token from the second of the logout passes
+        self.assertIs(await auth_cache.get_user("user-1", logout), self.user)
+        self.assertIs(await auth_cache.get_user("user-1", logout + 60), self.user)
+
+    async def test_users_without_revoked_tokens(self):
+        self.load_user.return_value = (self.user, None)
+        self.assertIs(await auth_cache.get_user("user-1", None), self.user)
+
+        self.load_user.return_value = None
+        self.assertIsNone(await auth_cache.get_user("user-2", None))
+
+    async def test_cached_until_invalidated(self):
+        issued_at = int(self.LOGOUT.timestamp()) + 1
+        await auth_cache.get_user("user-1", issued_at)
+        await auth_cache.get_user("user-1", issued_at)
+        self.assertEqual(self.load_user.call_count, 1)
+
+        # another process only has the shared cache
+        auth_cache._recent.clear()
+        await auth_cache.get_user("user-1", issued_at)
+        self.assertEqual(self.load_user.call_count, 1)
+
+        # logging out again revokes the token
+        self.load_user.return_value = (self.user, datetime(2026, 1, 2, tzinfo=timezone.utc))
+        auth_cache.invalidate_user("user-1")
+        self.assertIsNone(await auth_cache.get_user("user-1", issued_at))
+        self.assertEqual(self.load_user.call_count, 2)
+
+    async def test_falls_back_to_the_database_when_the_cache_is_down(self):
+        down = RedisConnectionError("Connection refused")
+        with mock.patch.object(cache, "aget", side_effect=down), mock.patch.object(cache, "aset", side_effect=down):
+            self.assertIs(await auth_cache.get_user("user-1", int(self.LOGOUT.timestamp())), self.user)
+
+        with mock.patch.object(cache, "delete", side_effect=down):
+            auth_cache.invalidate_user("user-1")
+        self.assertNotIn("user-1", auth_cache._recent)
+
+    async def test_middleware_checks_the_token_issue_time(self):
+        async def app(scope, receive, send):
+            return scope["user"]
+
+        def connect(issued_at):
+            token = jwt.encode({"user_id": "user-1", "iat": issued_at}, settings.SECRET_KEY, algorithm="HS256")
+            return JWTAuthMiddleware(app)({"query_string": f"token={token}".encode()}, None, None)
+
+        logout = int(self.LOGOUT.timestamp())
+        self.assertIs(await connect(logout), self.user)
+        self.assertIsInstance(await connect(logout - 1), AnonymousUser)
+
+
+class DiscoverableByTest(TestCase):
+    LAGOS = Point(3.39, 6.45, srid=4326)
+
+    def setUp(self):
+        self.viewer = self.create_user("viewer")
+        self.visible = {
+            "everyone": self.create_user("everyone"),
+            "verified_viewers": self.create_user("verified_viewers", who_can_discover_me=WhoCanDiscover.VERIFIED_USER),
+            "complete_viewers": self.create_user("complete_viewers", require_profile_completion=True),
+        }
+        self.hidden = [
+            self.create_user("only_me", who_can_discover_me=WhoCanDiscover.ONLY_ME),
+            self.create_user("inactive", is_active=False),
+        ]
+        for rank, user in enumerate([*self.visible.values(), *self.hidden]):
+            UserRecommendation.objects.create(user=self.viewer, recommended_user=user, score=1.0, rank=rank)
+
+    def create_user(self, name, is_active=True, **preferences):
+        user = User.objects.create_user(
+            email=f"{name}@meetmesh.test", username=name, password="password",
+            base_location=self.LAGOS, is_active=is_active,
+        )
+        UserPreference.objects.filter(user=user).update(**preferences)
+        return user
+
+    def discovered(self):
+        """ (usernames near the viewer, usernames of their recommendations) """
+        nearby = User.objects.nearby(self.LAGOS, 10, viewer=self.viewer).exclude(id=self.viewer.id)
+
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        with mock.patch("user.views.presence.are_online", return_value={}):
+            response = client.get("/users/recommendations/")
+        self.assertEqual(response.status_code, 200)
+
+        recommended = User.objects.in_bulk([user["id"] for user in response.data["data"]])
+        return {user.username for user in nearby}, {user.username for user in recommended.values()}
+
+    def assertDiscovers(self, *names):
+        nearby, recommended = self.discovered()
+        self.assertEqual(nearby, set(names))
+        self.assertEqual(recommended, set(names))
+
+    def test_unverified_viewer_without_a_complete_profile(self):
+        self.assertDiscovers("everyone")
+
+    def test_verified_viewer(self):
+        User.objects.filter(id=self.viewer.id).update(is_verified=True)
+        self.viewer.refresh_from_db()
+
+        self.assertDiscovers("everyone", "verified_viewers")
+
+    def test_viewer_with_a_complete_profile(self):
+        User.objects.filter(id=self.viewer.id).update(has_completed_onboarding=True)
+        self.viewer.refresh_from_db()
+
+        self.assertDiscovers("everyone", "complete_viewers")
+
+    def test_only_me_and_inactive_users_are_never_discovered(self):
+        User.objects.filter(id=self.viewer.id).update(is_verified=True, has_completed_onboarding=True)
+        self.viewer.refresh_from_db()
+
+        self.assertDiscovers(*self.visible)
+
+
+@skipUnless(find_spec("fakeredis") and find_spec("lupa"), "needs fakeredis[lua]")
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChatConsumerTest(TransactionTestCase):
+    def setUp(self):
+        import fakeredis
+
+        self.alice, self.bob, self.carol = (
+            User.objects.create_user(email=f"{name}@meetmesh.test", username=name, password="password")
+            for name in ("alice", "bob", "carol")
+        )
+        self.room = Conversation.get_room(self.bob, self.alice)
+
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        for patcher in (
+            mock.patch.object(message_queue, "get_async_enqueue_script", lambda: redis.register_script(message_queue.ENQUEUE_SCRIPT)),
+            mock.patch.object(presence, "get_async_redis", lambda: redis),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def disconnect(self, *communicators):
+        for communicator in communicators:
+            await communicator.disconnect()
+
+    async def test_send_is_acknowledged_and_delivered_once(self):
+        alice, bob = await self.connect(self.alice), await self.connect(self.bob)
+        send = {"type": "message.send", "conversation": self.room.id, "content": "hello", "client_id": "k1"}
+
+        await alice.send_json_to(send)
+        ack = await alice.receive_json_from()
+        self.assertEqual(ack, {"type": "message.ack", "client_id": "k1", "id": ack["id"], "conversation": self.room.id})
+        delivered = await bob.receive_json_from()
+        self.assertEqual((delivered["type"], delivered["id"], delivered["message"]), ("message", ack["id"], "hello"))
+        # the sender's own devices get it too
+        self.assertEqual((await alice.receive_json_from())["id"], ack["id"])
+
+        # a retry is acknowledged with the same id and not delivered again
+        await alice.send_json_to({**send, "content": "hello again"})
+        self.assertEqual(await alice.receive_json_from(), ack)
+        self.assertTrue(await bob.receive_nothing())
+        await self.disconnect(alice, bob)
+
+    async def test_send_without_client_id_is_still_acknowledged(self):
+        alice = await self.connect(self.alice)
+
+        await alice.send_json_to({"type": "message.send", "conversation": self.room.id, "content": "hello"})
+        ack = await alice.receive_json_from()
+        self.assertEqual(ack["type"], "message.ack")
+        self.assertTrue(ack["client_id"])
+        await self.disconnect(alice)
+
+    async def test_typing_reaches_the_partner_only(self):
+        alice, bob = await self.connect(self.alice), await self.connect(self.bob)
+
+        await alice.send_json_to({"type": "typing", "conversation": self.room.id, "is_typing": False})
+        self.assertEqual(await bob.receive_json_from(), {
+            "type": "typing", "conversation": self.room.id, "user": self.alice.id, "is_typing": False,
+        })
+        self.assertTrue(await alice.receive_nothing())
+        await self.disconnect(alice, bob)
+
+    async def test_read_is_stored_and_broadcast(self):
+        alice, bob = await self.connect(self.alice), await self.connect(self.bob)
+
+        await bob.send_json_to({"type": "message.read", "conversation": self.room.id})
+        receipt = await alice.receive_json_from()
+        self.assertEqual((receipt["type"], receipt["user"]), ("message.read", self.bob.id))
+        self.assertEqual(await bob.receive_json_from(), receipt)
+
+        summary = await ConversationSummary.objects.aget(conversation=self.room, user=self.bob)
+        self.assertEqual(summary.last_read_at.isoformat(), receipt["read_at"])
+        await self.disconnect(alice, bob)
+
+    async def test_malformed_frames_are_answered_with_errors(self):
+        alice = await self.connect(self.alice)
+
+        for frame, error in (
+            ("not json", "Frames must be JSON text"),
+            ("[1, 2]", "Unknown message type"),
+            ('{"type": "message.delete"}', "Unknown message type"),
+        ):
+            await alice.send_to(text_data=frame)
+            self.assertEqual(await alice.receive_json_from(), {"type": "error", "error": error, "client_id": None})
+
+        await alice.send_json_to({"type": "message.send", "conversation": self.room.id, "client_id": "k1"})
+        error = await alice.receive_json_from()
+        self.assertEqual((error["type"], error["client_id"]), ("error", "k1"))
+        self.assertIn("content", error["error"])
+
+        # the socket is still usable
+        await alice.send_json_to({"type": "message.send", "conversation": self.room.id, "content": "hello", "client_id": "k1"})
+        self.assertEqual((await alice.receive_json_from())["type"], "message.ack")
+        await self.disconnect(alice)
+
+    async def test_non_participants_are_rejected(self):
+        carol, bob = await self.connect(self.carol), await self.connect(self.bob)
+
+        for frame in (
+            {"type": "message.send", "conversation": self.room.id, "content": "hello", "client_id": "k1"},
+            {"type": "typing", "conversation": self.room.id},
+            {"type": "message.read", "conversation": self.room.id},
+        ):
+            await carol.send_json_to(frame)
+            error = await carol.receive_json_from()
+            self.assertEqual((error["type"], error["error"]), ("error", "Conversation not found"))
+
+        self.assertTrue(await bob.receive_nothing())
+        await self.disconnect(carol, bob)
+
+    async def test_anonymous_sockets_are_closed(self):
+        communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/")
+        communicator.scope["user"] = AnonymousUser()
+
+        connected, _ = await communicator.connect()
+        self.assertFalse(connected)
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FeedCacheTest(SimpleTestCase):
+    LAGOS = Point(3.39, 6.45, srid=4326)
+
+    def setUp(self):
+        cache.clear()
+        self.user = SimpleNamespace(pk="viewer", id="viewer", is_verified=False, has_completed_onboarding=False)
+        self.ranked = [FeedCandidate(f"user-{index}", 1.0) for index in range(30)]
+        self.rank_feed = mock.patch.object(feed_cache, "rank_feed", return_value=self.ranked).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_ranked_once_until_invalidated(self):
+        key, ranked = feed_cache.get_ranked_feed_snapshot(self.user, self.LAGOS, 10, candidates=None)
+        self.assertEqual(feed_cache.get_ranked_feed_snapshot(self.user, self.LAGOS, 10, candidates=None), (key, ranked))
+        self.assertEqual(self.rank_feed.call_count, 1)
+
+        feed_cache.invalidate_preferences(self.user.id)
+        self.assertNotEqual(feed_cache.get_ranked_feed_snapshot(self.user, self.LAGOS, 10, candidates=None)[0], key)
+        self.assertEqual(self.rank_feed.call_count, 2)
+        self.assertEqual(feed_cache.feed_cache_stats(), {"hits": 1, "misses": 2, "hit_rate": 1 / 3})
+
+    def test_ranks_without_the_cache_when_it_is_down(self):
+        down = RedisConnectionError("Connection refused")
+
+        for method in ("get", "set", "get_many"):
+            with self.subTest(method=method), mock.patch.object(cache, method, side_effect=down):
+                self.assertEqual(
+                    feed_cache.get_ranked_feed_snapshot(self.user, self.LAGOS, 10, candidates=None), (None, self.ranked)
+                )
+                self.assertIsNone(feed_cache.load_ranked_feed("feed.anything"))
+                feed_cache.invalidate_location(self.LAGOS)
+
+    def test_unstored_ranking_is_a_single_page(self):
+        request = Request(APIRequestFactory().get("/users/feeds/?limit=10"))
+        request.user = self.user
+        paginator = FeedPagination()
+
+        with mock.patch.object(cache, "get", side_effect=RedisConnectionError("Connection refused")):
+            rank = lambda: feed_cache.get_ranked_feed_snapshot(self.user, self.LAGOS, 10, candidates=None)
+            page = paginator.paginate_ranking(rank, feed_cache.load_ranked_feed, request)
+
+        self.assertEqual(page, self.ranked[:10])
+        self.assertIsNone(paginator.get_next_link())
+
+
+@override_settings(CACHES=LOCMEM_CACHE)
+class FeedInvalidationTest(TestCase):
+    LAGOS = Point(3.39, 6.45, srid=4326)
+
+    def setUp(self):
+        cache.clear()
+        self.viewer, self.neighbour = (
+            User.objects.create_user(
+                email=f"{name}@meetmesh.test", username=name, password="password", base_location=self.LAGOS
+            )
+            for name in ("viewer", "neighbour")
+        )
+        self.far_away = User.objects.create_user(
+            email="far@meetmesh.test", username="far", password="password", base_location=Point(-46.63, -23.55, srid=4326)
+        )
+        self.rank_feed = mock.patch.object(feed_cache, "rank_feed", return_value=[]).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def get_feed(self):
+        """ the viewer's feed, returns how many times it has been ranked so far """
+        feed_cache.get_ranked_feed(self.viewer, self.LAGOS, 10, candidates=None)
+        return self.rank_feed.call_count
+
+    def assertInvalidates(self, change, invalidates=True):
+        ranked = self.get_feed()
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertEqual(self.get_feed(), ranked + invalidates)
+
+    def test_profile_change_nearby(self):
+        profile = self.neighbour.profile
+        profile.interests = ["music"]
+        self.assertInvalidates(profile.save)
+
+    def test_preference_change(self):
+        preference = self.viewer.user_preference
+        preference.require_profile_completion = True
+        self.assertInvalidates(preference.save)
+
+    def test_moving_into_or_out_of_the_area(self):
+        self.neighbour.base_location = Point(-46.6, -23.5, srid=4326)
+        self.assertInvalidates(self.neighbour.save)
+
+        self.far_away.base_location = Point(3.4, 6.46, srid=4326)
+        self.assertInvalidates(self.far_away.save)
+
+    def test_changes_elsewhere_keep_the_feed(self):
+        self.far_away.base_location = Point(-46.7, -23.6, srid=4326)
+        self.assertInvalidates(self.far_away.save, invalidates=False)
@@ -7,7 +7,7 @@ from rest_framework_simplejwt.views import (
  )
 
 from .views import UserViewset, TokenObtainPairView, UserPreferenceViewset, ProfileViewset
-from .consumer import ChatConsumer
+from .consumer import ChatConsumer, LocationConsumer
 
 router = DefaultRouter()
 router.register("users", UserViewset, basename="users")
@@ -25,4 +25,5 @@ urlpatterns = [
 
 websocket_urlpatterns = [
     path('ws/chat/', ChatConsumer.as_asgi()),
+    path('ws/location/', LocationConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -12,9 +12,13 @@ from django.db import transaction
 from geopy.distance import distance as geopy_distance
 from rest_framework_simplejwt.tokens import RefreshToken
 
+from utilities.pagination import FeedPagination
+from utilities.utils import generate_uuid
 from .models import UserPreference, Profile
+from . import feed_cache, gazetteer, presence
 from core.models import Meetup, Conversation
 from core.serializers import MessageSerializer
+from core import message_queue
 from .serializers import UserSerializer, TokenObtainSerializer, ProfileSerializer
 from channels.layers import get_channel_layer
 from asgiref.sync import async_to_sync
@@ -147,11 +151,23 @@ class UserViewset(viewsets.ModelViewSet):
         return Response(serializer.errors, status=400)
 
     @action(methods=["get"], detail=False, permission_classes=[permissions.IsAuthenticated])
+    def cities(self, request, *args, **kwargs):
+        """ city autocomplete for onboarding, ?q=<prefix>&country=<code or name> """
+        matches = gazetteer.get_gazetteer().search(request.query_params.get("q", ""), request.query_params.get("country"))
+        return Response({
+            "status": "success",
+            "message": "Matching cities",
+            "data": [
+                {"name": match.name, "country": match.country, "latitude": match.latitude, "longitude": match.longitude}
+                for match in matches
+            ]
+        })
+
+    @action(methods=["get"], detail=False, permission_classes=[permissions.IsAuthenticated], pagination_class=FeedPagination)
     def feeds(self, request, *args, **kwargs):
         user = request.user
         location = user.base_location
-        interests = set(user.profile.interests or [])
-        radius_km = getattr(user.user_preference, "notify_radius_km", 1000)
+        radius_km = getattr(user.user_preference, "notify_radius_km", None) or 1000
 
         if not location:
             return Response({
@@ -160,22 +176,45 @@ class UserViewset(viewsets.ModelViewSet):
                 "data": []
             }, status=400)
 
-        other_users = User.objects.exclude(id=user.id).select_related('profile')
+        candidates = User.objects.nearby(location, radius_km, viewer=user).exclude(id=user.id)
+        # ranked once per scroll, the following pages are slices of the same ranking
+        ranked = self.paginator.paginate_ranking(
+            lambda: feed_cache.get_ranked_feed_snapshot(user, location, radius_km, candidates),
+            feed_cache.load_ranked_feed, request, view=self
+        )
 
-        page = self.paginate_queryset(other_users)
-        if page is not None:
-            serializer = UserSerializer.UserFeedSerializer(page, many=True)
-            return self.get_paginated_response({
-                "status": "success",
-                "message": "Nearby users with shared interests",
-                "data": serializer.data
-            })
+        users = candidates.filter(id__in=[candidate.id for candidate in ranked]).select_related('profile').in_bulk()
+        # a ranking can name users that were deleted or hidden since
+        other_users = [users[candidate.id] for candidate in ranked if candidate.id in users]
 
-        serializer = UserSerializer.UserFeedSerializer(other_users, many=True)
-        return Response({
+        serializer = UserSerializer.UserFeedSerializer(
+            other_users, many=True, context={"online": presence.are_online([user.id for user in other_users])}
+        )
+        data = {
             "status": "success",
             "message": "Nearby users with shared interests",
             "data": serializer.data
+        }
+        return self.get_paginated_response(data)
+
+    @action(methods=["get"], detail=False, permission_classes=[permissions.IsAdminUser])
+    def feeds_cache_stats(self, request, *args, **kwargs):
+        return Response(data=feed_cache.feed_cache_stats())
+
+    @action(methods=["get"], detail=False, permission_classes=[permissions.IsAuthenticated])
+    def recommendations(self, request, *args, **kwargs):
+        """ precomputed people-like-you list, see user/recommendation.py """
+        users = User.objects.discoverable_by(request.user).filter(
+            recommended_to__user=request.user
+        ).select_related('profile').order_by('recommended_to__rank')
+
+        serializer = UserSerializer.UserFeedSerializer(
+            users, many=True, context={"online": presence.are_online([user.id for user in users])}
+        )
+        return Response({
+            "status": "success",
+            "message": "Users with similar interests",
+            "data": serializer.data
         })
 
     @action(methods=['post'], detail=True, permission_classes=[permissions.IsAuthenticated])
@@ -184,27 +223,25 @@ class UserViewset(viewsets.ModelViewSet):
         receiver = self.get_object()
 
         room = Conversation.get_room(receiver, sender)
-        message_serializer = MessageSerializer.MessageCreateSerializer(
-            data=dict(
-                conversation = room.id,
-                sender=sender.id,
-                content=request.data['content']
-            )
-        )
-
-        # the sender is online to be able to send message, check if the receiver has a channel_name send messge else save to db
-        # add user to group
-        async_to_sync(channel_layer.group_add)(f"conversation_{room.id}", sender.channel_name)
+        message_serializer = MessageSerializer.MessageSendSerializer(data=request.data)
+        message_serializer.is_valid(raise_exception=True)
+        content = message_serializer.validated_data['content']
+        client_id = message_serializer.validated_data.get('client_id') or generate_uuid()
 
-        if(receiver.channel_name):
-            async_to_sync(channel_layer.group_add)(f"conversation_{room.id}", receiver.channel_name)
+        # stored later by manage.py persist_messages, a retry with the same client_id is not sent twice
+        message_id, created = message_queue.enqueue(room.id, sender.id, content, client_id)
 
-        async_to_sync(channel_layer.group_send)(f"conversation_{room.id}", {"type": "send_mesage", "message": request.data['content']})
-        # TODO: send notication
+        if created:
+            # every open socket of both participants, the sender's other devices included
+            event = {
+                "type": "chat.message", "conversation": room.id, "id": message_id,
+                "client_id": client_id, "sender": sender.id, "message": content,
+            }
+            for participant in {sender, receiver}:
+                async_to_sync(channel_layer.group_send)(participant.group_name, event)
+            # TODO: send notication
 
-        message_serializer.is_valid(raise_exception=True)
-        message_serializer.save()
-        return Response(data=dict(message="Send successfully"))
+        return Response(data=dict(message="Send successfully", data=dict(id=message_id, client_id=client_id, conversation=room.id)), status=202)
 
     @action(methods=['put'], detail=True, permission_classes=[permissions.IsAuthenticated])
     def update_user_preferences(self, request, *args, **kwargs):
@@ -0,0 +1,212 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.signing import BadSignature, Signer
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class BaseCursorPagination(BasePagination):
+    """ page size and opaque base64 JSON cursors shared by the paginators below """
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def read_cursor(self, request):
+        """ the decoded cursor of the request, None on the first page """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode("ascii")))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(cursor, dict):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def write_cursor(self, cursor):
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor, separators=(",", ":")).encode("ascii")).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+
+class KeysetPagination(BaseCursorPagination):
+    """
+    Cursor pagination over a composite sort key such as ("-created_at", "-id").
+
+    The cursor carries the sort key of the row at the edge of the page and the
+    neighbouring page is fetched with a keyset comparison on it, so page N costs
+    the same as page 1 and rows inserted while a client scrolls never shift the
+    window. The last field of `ordering` must be unique.
+    """
+    ordering = ("-created_at", "-id")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request)
+
+        ordering = [self._invert(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = position is not None, has_more
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+    def get_keyset_filter(self, ordering, position):
+        """
+        Rows strictly after `position` in `ordering`, i.e. the expansion of
+        (a, b) > (x, y) into (a > x) OR (a = x AND b > y).
+        """
+        keyset = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = Q(**{f"{name}__{lookup}": position[index]})
+            for previous, value in zip(ordering[:index], position):
+                condition &= Q(**{previous.lstrip("-"): value})
+            keyset |= condition
+        return keyset
+
+    def get_position(self, instance):
+        return [self._encode_value(getattr(instance, field.lstrip("-"))) for field in self.ordering]
+
+    def decode_cursor(self, request):
+        cursor = self.read_cursor(request)
+        if cursor is None:
+            return None, False
+
+        try:
+            position, reverse = cursor["p"], bool(cursor["r"])
+        except KeyError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        return self.write_cursor({"p": position, "r": int(reverse)})
+
+    @staticmethod
+    def _encode_value(value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+
+class SnapshotPagination(BaseCursorPagination):
+    """
+    Offset pagination over a ranking frozen for one scroll session.
+
+    The first page asks for (snapshot key, ranked list), the cursors of the
+    following pages carry that key, signed for the requesting user, and an
+    offset. Later pages load the same list back by its key, so however the
+    scores moved since, a scroll never repeats or skips an item and nothing is
+    ranked again. A cursor whose snapshot expired is rejected and the client
+    starts over. A ranking that could not be stored has no key, and then only
+    its first page is served.
+    """
+    snapshot_salt = "ranking_snapshot"
+    expired_cursor_message = "This list has expired, reload it"
+
+    def paginate_ranking(self, rank, load, request, view=None):
+        """
+        a page of rank(), which returns (snapshot key, full ranked list) and is only
+        called for the first page, load(snapshot key) returns the list again or None
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.signer = Signer(salt=f"{self.snapshot_salt}.{request.user.pk}")
+        cursor = self.read_cursor(request)
+
+        if cursor is None:
+            self.offset = 0
+            self.snapshot_key, ranking = rank()
+        else:
+            try:
+                self.snapshot_key, self.offset = self.signer.unsign(str(cursor["s"])), _positive_int(cursor["o"])
+            except (KeyError, TypeError, ValueError, BadSignature):
+                raise NotFound(self.invalid_cursor_message)
+            ranking = load(self.snapshot_key)
+            if ranking is None:
+                raise NotFound(self.expired_cursor_message)
+
+        self.page = ranking[self.offset:self.offset + self.page_size]
+        self.has_next = self.snapshot_key is not None and self.offset + self.page_size < len(ranking)
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.write_cursor({"s": self.signer.sign(self.snapshot_key), "o": self.offset + self.page_size})
+
+    def get_previous_link(self):
+        if not self.offset:
+            return None
+        return self.write_cursor({"s": self.signer.sign(self.snapshot_key), "o": max(self.offset - self.page_size, 0)})
+
+
+class FeedPagination(SnapshotPagination):
+    """ snapshots are user/feed_cache.py entries """
+    snapshot_salt = "feed_snapshot"
+
+
+class ConversationPagination(KeysetPagination):
+    ordering = ("-last_message_time", "-id")
+
+
+class MessagePagination(KeysetPagination):
+    ordering = ("-created_at", "-id")